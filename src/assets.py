@@ -0,0 +1,316 @@
+import json
+import mmap
+import struct
+import pygame
+from collections import OrderedDict
+
+from files import atomic_open
+
+# Default memory budget for cached surfaces (bytes)
+ASSET_BUDGET = 256 * 1024 * 1024
+
+# Asset packs: pre-scaled RGBA pixels written by bake.py, memory-mapped at runtime.
+# Layout: header, JSON index {name: [offset, width, height]}, then the pixel data.
+PACK_MAGIC = b"APAK"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sBI")  # magic, version, index size in bytes
+PACK_ALIGN = 64
+
+
+def pack_name(path, size=None, index=None):
+    # Name of an image (or of frame number index of a sprite sheet) at a given size
+    name = path
+    if index is not None:
+        name += f"#{index}"
+    if size:
+        name += f"@{int(size[0])}x{int(size[1])}"
+    return name
+
+
+def align(offset):
+    return (offset + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+
+
+def write_pack(path, surfaces):
+    # surfaces: {name: surface}
+    index = {}
+    offset = 0
+    for name, surface in surfaces.items():
+        index[name] = [offset, surface.get_width(), surface.get_height()]
+        offset = align(offset + surface.get_width() * surface.get_height() * 4)
+    index_data = json.dumps(index).encode()
+    data_start = align(PACK_HEADER.size + len(index_data))
+
+    with atomic_open(path) as file:
+        file.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(index_data)))
+        file.write(index_data)
+        for name, surface in surfaces.items():
+            file.seek(data_start + index[name][0])
+            file.write(pygame.image.tobytes(surface, "RGBA"))
+        file.truncate(data_start + offset)
+
+
+class AssetPack:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            # Copy-on-write mapping: pages are read lazily and never written back
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, version, index_size = PACK_HEADER.unpack_from(self.map)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path} is not a version {PACK_VERSION} asset pack")
+        self.index = json.loads(self.map[PACK_HEADER.size:PACK_HEADER.size + index_size])
+        self.data_start = align(PACK_HEADER.size + index_size)
+        self.view = memoryview(self.map)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def surface(self, name):
+        # Wraps the mapped pixels without decoding or copying; safe to call from a loader thread
+        offset, width, height = self.index[name]
+        start = self.data_start + offset
+        return pygame.image.frombuffer(self.view[start:start + width * height * 4], (width, height), "RGBA")
+
+
+class AssetCache:
+    def __init__(self, budget=ASSET_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self.surfaces = OrderedDict()  # key -> surface, oldest first
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0  # Times a file was actually read from disk
+        self.evictions = 0
+        self.pack = None
+        self.pack_loads = 0  # Surfaces taken from the asset pack instead of decoding a file
+
+    def open_pack(self, path):
+        self.pack = AssetPack(path)
+        return self.pack
+
+    def pack_surface(self, name):
+        if self.pack is not None and name in self.pack:
+            return self.pack.surface(name)
+        return None
+
+    def image(self, path, size=None, rotation=0, flip=(False, False), convert="alpha"):
+        # Every variant (scaled, rotated, flipped) is cached under its own key
+        key = (path, tuple(size) if size else None, rotation, tuple(flip), convert)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+
+        packed = None if rotation or any(flip) else self.pack_surface(pack_name(path, size))
+        if packed is not None:
+            surface = self.convert(packed, convert)
+            self.pack_loads += 1
+        elif rotation or any(flip):
+            # Build the variant from the scaled image, which is cached too
+            surface = self.image(path, size, convert=convert)
+            if rotation:
+                surface = pygame.transform.rotate(surface, rotation)
+            if any(flip):
+                surface = pygame.transform.flip(surface, flip[0], flip[1])
+        elif size:
+            # Build the variant from the plain image. The full-size source is only
+            # kept if something already cached it, only the scaled copy is drawn.
+            source = self.surfaces.get((path, None, 0, (False, False), convert))
+            if source is None:
+                source = self.convert(pygame.image.load(path), convert)
+                self.decodes += 1
+            surface = pygame.transform.scale(source, (int(size[0]), int(size[1])))
+        else:
+            surface = self.convert(pygame.image.load(path), convert)
+            self.decodes += 1
+
+        self.store(key, surface)
+        return surface
+
+    def frame(self, path, index, frame_size, size, convert="alpha", keep=True):
+        # Frame number index of a vertical sprite sheet, scaled to size.
+        # keep=False skips caching the frame, for callers that copy it elsewhere;
+        # the sheet it is cut from stays cached until discard() drops it.
+        name = pack_name(path, size, index)
+        key = (name, tuple(size), 0, (False, False), convert)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+
+        packed = self.pack_surface(name)
+        if packed is not None:
+            surface = self.convert(packed, convert)
+            self.pack_loads += 1
+        else:
+            sheet = self.image(path, convert=convert)
+            width, height = frame_size
+            surface = sheet.subsurface((0, index * height, width, height))
+            surface = pygame.transform.scale(surface, (int(size[0]), int(size[1])))
+        if keep:
+            self.store(key, surface)
+        return surface
+
+    def insert(self, path, surface, size=None, convert="alpha"):
+        # Add a surface decoded elsewhere (e.g. on a loader thread) under the key image() looks up.
+        # Must be called from the main thread, conversion needs the display.
+        key = (path, tuple(size) if size else None, 0, (False, False), convert)
+        if key in self.surfaces:
+            self.surfaces.move_to_end(key)
+            return self.surfaces[key]
+        surface = self.convert(surface, convert)
+        self.store(key, surface)
+        return surface
+
+    def convert(self, surface, mode):
+        # Conversion needs a display; without one keep the decoded pixel format
+        if pygame.display.get_surface() is None:
+            return surface
+        if mode == "alpha":
+            return surface.convert_alpha()
+        if mode == "opaque":
+            return surface.convert()
+        return surface
+
+    def store(self, key, surface):
+        size = surface.get_bytesize() * surface.get_width() * surface.get_height()
+        self.surfaces[key] = surface
+        self.used += size
+        # Evict least recently used surfaces until we fit the budget again
+        while self.used > self.budget and len(self.surfaces) > 1:
+            old_key, old_surface = self.surfaces.popitem(last=False)
+            self.used -= old_surface.get_bytesize() * old_surface.get_width() * old_surface.get_height()
+            self.evictions += 1
+
+    def discard(self, path, size=None, convert="alpha"):
+        # Drop a cached image, e.g. a sheet whose frames were copied into an atlas
+        key = (path, tuple(size) if size else None, 0, (False, False), convert)
+        surface = self.surfaces.pop(key, None)
+        if surface is not None:
+            self.used -= surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+    def clear(self):
+        self.surfaces.clear()
+        self.used = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.surfaces),
+            "bytes": self.used,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "decodes": self.decodes,
+            "evictions": self.evictions,
+            "pack_loads": self.pack_loads,
+        }
+
+
+# Sprite atlases: every frame is trimmed to its visible pixels and packed into
+# rows of one surface, so an animation is a list of source rects into it.
+ATLAS_WIDTH = 1024
+ATLAS_PADDING = 1  # Keeps scaled or filtered neighbours from bleeding into each other
+
+
+class SpriteAtlas:
+    def __init__(self, animations, flipped=None, width=ATLAS_WIDTH):
+        # animations: {name: [surface, ...]}, flipped: {name: name of the animation to mirror}
+        trimmed = {name: [self.trim(frame) for frame in frames] for name, frames in animations.items()}
+        for name, source in (flipped or {}).items():
+            trimmed[name] = [
+                (pygame.transform.flip(image, True, False), (frame_width - x - image.get_width(), y), frame_width)
+                for image, (x, y), frame_width in trimmed[source]
+            ]
+
+        # Shelf packing, tallest frames first
+        order = sorted(
+            ((name, i) for name, frames in trimmed.items() for i in range(len(frames))),
+            key=lambda item: -trimmed[item[0]][item[1]][0].get_height(),
+        )
+        places = {}
+        x = y = shelf_height = 0
+        for name, i in order:
+            image = trimmed[name][i][0]
+            if x + image.get_width() > width:
+                x, y, shelf_height = 0, y + shelf_height + ATLAS_PADDING, 0
+            places[name, i] = (x, y)
+            x += image.get_width() + ATLAS_PADDING
+            shelf_height = max(shelf_height, image.get_height())
+
+        surface = pygame.Surface((width, max(1, y + shelf_height)), pygame.SRCALPHA)
+        self.frames = {}  # name -> [(source rect, offset in the frame), ...]
+        for name, frames in trimmed.items():
+            self.frames[name] = []
+            for i, (image, offset, frame_width) in enumerate(frames):
+                surface.blit(image, places[name, i])
+                self.frames[name].append((pygame.Rect(places[name, i], image.get_size()), offset))
+        self.surface = assets.convert(surface, "alpha")
+
+    @staticmethod
+    def trim(frame):
+        bounds = frame.get_bounding_rect()
+        return frame.subsurface(bounds).copy(), bounds.topleft, frame.get_width()
+
+    def count(self, name):
+        return len(self.frames[name])
+
+    def blit(self, screen, name, index, position):
+        area, (x, y) = self.frames[name][index]
+        screen.blit(self.surface, (position[0] + x, position[1] + y), area)
+
+    def bytes(self):
+        return self.surface.get_bytesize() * self.surface.get_width() * self.surface.get_height()
+
+
+# Rendered text labels, keyed by (font, text, color, outline color)
+TEXT_CACHE_SIZE = 256
+OUTLINE_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1), (-1, 1), (1, -1)]
+
+
+class TextCache:
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.labels = OrderedDict()
+        self.hits = 0
+        self.misses = 0  # Times text was actually rasterized
+
+    def render(self, font, text, color, outline=None):
+        key = (font, text, color, outline)
+        label = self.labels.get(key)
+        if label is not None:
+            self.hits += 1
+            self.labels.move_to_end(key)
+            return label
+        self.misses += 1
+
+        if outline is None:
+            label = font.render(text, True, color)
+        else:
+            # Bake the outline and the text into one surface with a 1px border
+            outline_text = font.render(text, True, outline)
+            main_text = font.render(text, True, color)
+            label = pygame.Surface((main_text.get_width() + 2, main_text.get_height() + 2), pygame.SRCALPHA)
+            for dx, dy in OUTLINE_OFFSETS:
+                label.blit(outline_text, (1 + dx, 1 + dy))
+            label.blit(main_text, (1, 1))
+
+        self.labels[key] = label
+        if len(self.labels) > self.max_entries:
+            self.labels.popitem(last=False)
+        return label
+
+    def clear(self):
+        self.labels.clear()
+
+    def stats(self):
+        return {"entries": len(self.labels), "hits": self.hits, "misses": self.misses}
+
+
+# Shared caches used by the whole game
+assets = AssetCache()
+text_cache = TextCache()
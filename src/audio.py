@@ -0,0 +1,54 @@
+import io
+import math
+import wave
+from array import array
+
+import pygame
+
+# Audio helpers: decoding songs ahead of playback and the calibration click
+# track. Everything here is in the initialized mixer's format (16-bit samples).
+
+CLICK_MS = 30  # Length of one calibration click
+CLICK_PITCH = 1000  # Hz
+
+
+def wav_bytes(pcm):
+    # Wrap raw mixer samples in a WAV header, so pygame.mixer.music can stream them
+    frequency, size, channels = pygame.mixer.get_init()
+    output = io.BytesIO()
+    with wave.open(output, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(abs(size) // 8)
+        file.setframerate(frequency)
+        file.writeframes(pcm)
+    return output.getvalue()
+
+
+def decode_song(data):
+    # Compressed song bytes -> WAV bytes; safe to call from a worker thread once the mixer is up
+    return wav_bytes(pygame.mixer.Sound(io.BytesIO(data)).get_raw())
+
+
+def click_track(beat_ms, beats):
+    # A short click on every beat, the first one beat_ms after the start
+    frequency, size, channels = pygame.mixer.get_init()
+    beat_frames = frequency * beat_ms // 1000
+    click = array("h", (
+        int(20000 * math.sin(2 * math.pi * CLICK_PITCH * i / frequency) * (1 - i / (frequency * CLICK_MS // 1000)))
+        for i in range(frequency * CLICK_MS // 1000)
+    ))
+    beat = click + array("h", bytes(2 * (beat_frames - len(click))))
+    silence = array("h", bytes(2 * beat_frames))
+    mono = silence + beat * beats
+    samples = array("h", bytes(2 * len(mono) * channels))
+    for channel in range(channels):
+        samples[channel::channels] = mono
+    return wav_bytes(samples.tobytes())
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+
+# Bakes every game image, already scaled for a target resolution, into one
+# uncompressed asset pack that the game memory-maps at startup.
+# Usage: python bake.py [--width 1280] [--height 720] [--output assets-1280x720.pack]
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+LAUNCH_DIR = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import program
+from assets import pack_name, write_pack
+
+
+def load(path):
+    # Plain decode, so the pack never depends on a pack that already exists
+    return pygame.image.load(path)
+
+
+def collect(width, height):
+    surfaces = {}
+
+    # Backgrounds, scaled to the full screen
+    for paths in program.phase_layers.values():
+        for path in paths:
+            surfaces[pack_name(path, (width, height))] = pygame.transform.scale(load(path), (width, height))
+
+    # Note and fixed arrows
+    for path in program.note_arrows + [program.fixed_arrow]:
+        surfaces[pack_name(path, program.arrow_size)] = pygame.transform.scale(load(path), program.arrow_size)
+
+    # Character animation frames
+    for path, frame_width, frame_height, num_frames in program.cryer_animations.values():
+        sheet = load(path)
+        size = program.cryer_frame_size(frame_width, frame_height)
+        for i in range(num_frames):
+            frame = sheet.subsurface((0, i * frame_height, frame_width, frame_height))
+            surfaces[pack_name(path, size, i)] = pygame.transform.scale(frame, size)
+    return surfaces
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bake pre-scaled game assets into a memory-mappable pack")
+    parser.add_argument("--width", type=int, default=program.WIDTH)
+    parser.add_argument("--height", type=int, default=program.HEIGHT)
+    parser.add_argument("--output", help="pack file (default: assets-WIDTHxHEIGHT.pack next to the game)")
+    args = parser.parse_args()
+
+    program.set_render_size(args.width, args.height)
+    output = os.path.join(LAUNCH_DIR, args.output) if args.output else f"assets-{args.width}x{args.height}.pack"
+    start = time.perf_counter()
+    surfaces = collect(args.width, args.height)
+    write_pack(output, surfaces)
+    print(f"Baked {len(surfaces)} images into {output} "
+          f"({os.path.getsize(output) / 2**20:.1f} MiB, {time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
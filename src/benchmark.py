@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Headless benchmarks for the game's hot paths.
+# Usage: python benchmark.py [--frames 600] [--render-size 640x360] [--output results.json]
+# The pacing scenario runs in real time, frames / 2 menu frames per pacing mode.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # Keep stdout valid JSON
+LAUNCH_DIR = os.getcwd()  # --output is relative to where the benchmark was started
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import program
+from settings import parse_size
+from pacing import FramePacer, PACING_MODES
+
+STRESS_LEVELS = [250, 1000, 5000]  # Notes on screen at once
+BENCH_SONG = "musica2.mp3"
+
+
+def percentiles(samples_ns):
+    # Summary of a list of timings in nanoseconds, reported in milliseconds
+    if not samples_ns:
+        return {}
+    ordered = sorted(samples_ns)
+    last = len(ordered) - 1
+
+    def pick(fraction):
+        return ordered[min(last, int(round(fraction * last)))] / 1e6
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) / 1e6,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] / 1e6,
+    }
+
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    def measure(self, stage, function, *args):
+        start = time.perf_counter_ns()
+        result = function(*args)
+        self.stages.setdefault(stage, []).append(time.perf_counter_ns() - start)
+        return result
+
+    def report(self, frame_stage=None):
+        result = {"stages": {stage: percentiles(samples) for stage, samples in self.stages.items()}}
+        if frame_stage in self.stages:
+            mean_ms = result["stages"][frame_stage]["mean_ms"]
+            result["fps"] = 1000 / mean_ms if mean_ms else None
+        return result
+
+
+def start_play(game, difficulty, note_cooldown=None):
+    game.song_selected = program.library.find(BENCH_SONG)
+    game.difficulty = difficulty
+    game.note_cooldown = game.base_note_cooldown // difficulty
+    game.start_game(wait=True)
+    if note_cooldown is not None:
+        # Synthetic density: random notes every note_cooldown ms instead of the chart
+        game.chart = None
+        game.note_cooldown = note_cooldown
+        game.last_note_spawn_time = -note_cooldown
+
+
+def bench_play(game, frames, difficulty, note_cooldown=None):
+    start_play(game, difficulty, note_cooldown)
+    # Let the lanes fill up before measuring
+    for _ in range(int(program.note_travel_time / program.TICK_MS) + 1):
+        game.step_play()
+
+    timer = Timer()
+    notes_on_screen = []
+    for _ in range(frames):
+        start = time.perf_counter_ns()
+        timer.measure("step_play", game.step_play)
+        timer.measure("handle_play", game.handle_play, 0.5)
+        timer.measure("draw_hud", program.draw_hud)
+        timer.measure("present", program.present)
+        timer.stages.setdefault("frame", []).append(time.perf_counter_ns() - start)
+        notes_on_screen.append(len(game.notes))
+        if game.state != "playing":
+            break
+    result = timer.report("frame")
+    result["difficulty"] = difficulty
+    result["chart"] = game.chart is not None
+    result["notes_on_screen"] = sum(notes_on_screen) / len(notes_on_screen)
+    game.back_to_menu()
+    return result
+
+
+def bench_note_draw(game, frames):
+    # Game.draw_notes with the lanes full and half the notes dissipating
+    start_play(game, 5, note_cooldown=program.note_travel_time / 200)
+    for _ in range(int(program.note_travel_time / program.TICK_MS) + 1):
+        game.step_play()
+    for queue in game.notes.lanes:
+        for note in list(queue)[::2]:
+            game.notes.judge(note)
+            program.calculate_score(note, "good")
+    game.step_play()
+
+    timer = Timer()
+    for _ in range(frames):
+        timer.measure("draw_notes", game.draw_notes, game.play_time)
+    game.back_to_menu()
+    return timer.report()
+
+
+def bench_backgrounds(game, frames):
+    timer = Timer()
+    screen = program.screen
+    for phase in [-1, 0, 1, 2]:
+        background = game.background_selection(phase)
+        for stage in [f"phase_{phase}", f"phase_{phase}_paused"]:
+            if stage.endswith("_paused"):
+                background.pause()
+            for _ in range(frames):
+                start = time.perf_counter_ns()
+                background.step()
+                background.draw(screen, 0.5)
+                timer.stages.setdefault(stage, []).append(time.perf_counter_ns() - start)
+    return timer.report()
+
+
+def bench_cryer(frames):
+    cryer = program.BigCryer()
+    timer = Timer()
+    actions = ["start_walk", "jump", "crouch", "trick1", "trick2"]
+    for frame in range(frames):
+        now = frame * program.TICK_MS
+        if frame % 60 == 0:
+            cryer.set_animation(actions[frame // 60 % len(actions)], now)
+        timer.measure("draw", cryer.draw, program.screen, now)
+    return timer.report()
+
+
+def bench_calculate_score(frames):
+    note = program.Note(program.lanes[0], 0)
+    timer = Timer()
+    accuracies = ["early", "good", "half", "miss"]
+    for i in range(frames * 10):
+        timer.measure("calculate_score", program.calculate_score, note, accuracies[i % 4])
+    return timer.report()
+
+
+def bench_menu(game, frames):
+    game.back_to_menu()
+    timer = Timer()
+    for _ in range(frames):
+        start = time.perf_counter_ns()
+        timer.measure("step", game.step)
+        timer.measure("handle_menu", game.handle_menu, 0.5)
+        timer.stages.setdefault("frame", []).append(time.perf_counter_ns() - start)
+    return timer.report("frame")
+
+
+def bench_pacing(game, frames, frame_rate=60):
+    # The same menu frames under each pacing mode, to pick the steadiest one for this machine.
+    # vsync is paced by the display's flip, which the benchmark window doesn't wait on.
+    results = {}
+    for mode in PACING_MODES:
+        if mode == "vsync":
+            continue
+        game.back_to_menu()
+        pacer = FramePacer(mode, frame_rate)
+        for _ in range(frames):
+            game.step()
+            game.handle_menu(0.5)
+            program.present()
+            pacer.tick()
+        results[mode] = pacer.stats()
+    return results
+
+
+def run(frames):
+    program.init()
+    game = program.Game()
+    game.use_audio_clock = False  # Measure as fast as possible, not in step with the music
+    results = {}
+    for difficulty in [1, 2, 3, 4, 5]:
+        results[f"play_difficulty_{difficulty}"] = bench_play(game, frames, difficulty)
+    for level in STRESS_LEVELS:
+        results[f"play_stress_{level}"] = bench_play(game, frames, 5, note_cooldown=program.note_travel_time / level)
+    results["note_draw"] = bench_note_draw(game, max(1, frames // 10))
+    results["background"] = bench_backgrounds(game, frames)
+    results["cryer"] = bench_cryer(frames)
+    results["calculate_score"] = bench_calculate_score(frames)
+    results["menu"] = bench_menu(game, frames)
+    results["pacing"] = bench_pacing(game, max(2, frames // 2))  # The first tick only starts the clock
+    return {
+        "pygame": program.pygame.version.ver,
+        "python": sys.version.split()[0],
+        "frames": frames,
+        "render_size": [program.WIDTH, program.HEIGHT],
+        "assets": program.assets.stats(),
+        "text": program.text_cache.stats(),
+        "cryer_atlas_bytes": program.load_cryer_atlas().bytes(),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmarks for the game's hot paths")
+    parser.add_argument("--frames", type=int, default=600, help="frames measured per scenario")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--render-size", type=parse_size, metavar="WxH", help="internal resolution (default from settings.json)")
+    args = parser.parse_args()
+    if args.render_size:
+        program.set_render_size(*args.render_size)
+
+    report = run(args.frames)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(os.path.join(LAUNCH_DIR, args.output), "w") as file:
+            file.write(text)
+    else:
+        print(text)
+
+    # Short summary for humans
+    for name, result in report["results"].items():
+        if "fps" in result:
+            print(f"{name:24} {result['fps']:10.1f} fps", file=sys.stderr)
+    for mode, stats in report["results"]["pacing"].items():
+        print(f"pacing_{mode:17} {stats['fps']:10.1f} fps, jitter {stats['jitter_ms']:.2f} ms, "
+              f"1% low {stats['low_1_fps']:.1f}, 0.1% low {stats['low_01_fps']:.1f}, missed {stats['missed']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import sys
+import struct
+import hashlib
+
+from files import write_atomic
+
+# Note charts generated offline from the songs' onsets.
+# A chart file sits next to its song, e.g. musica2.3f2a9c1b04de.d3.chart,
+# so a changed mp3 gets a new chart and an old chart is never reused.
+
+CHART_MAGIC = b"CHRT"
+CHART_VERSION = 1
+CHART_HEADER = struct.Struct("<4sBBI")  # magic, version, difficulty, note count
+CHART_NOTE = struct.Struct("<IB")  # time in ms, lane
+
+DIFFICULTIES = [1, 2, 3, 4, 5]
+BASE_NOTE_GAP = 1000  # Smallest gap between notes at difficulty 1, same as Game.base_note_cooldown
+LANE_COUNT = 4
+
+# Analysis settings
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+THRESHOLD_WINDOW = 16  # Frames on each side used for the adaptive threshold
+THRESHOLD_DELTA = 0.05
+
+
+def song_hash(song_path):
+    digest = hashlib.sha1()
+    with open(song_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def data_hash(data):
+    # Same digest as song_hash, for a song already read into memory
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def chart_digest(notes):
+    # Identifies a chart by its notes, "" for no chart
+    if notes is None:
+        return ""
+    return data_hash(b"".join(CHART_NOTE.pack(time_ms, lane) for time_ms, lane in notes))
+
+
+def chart_path(song_path, difficulty, digest=None):
+    if digest is None:
+        digest = song_hash(song_path)
+    base = os.path.splitext(song_path)[0]
+    return f"{base}.{digest}.d{difficulty}.chart"
+
+
+def write_chart(path, difficulty, notes):
+    data = bytearray(CHART_HEADER.pack(CHART_MAGIC, CHART_VERSION, difficulty, len(notes)))
+    for time_ms, lane in notes:
+        data += CHART_NOTE.pack(time_ms, lane)
+    write_atomic(path, bytes(data))  # A half written chart is never picked up
+
+
+def read_chart(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, difficulty, count = CHART_HEADER.unpack_from(data)
+    if magic != CHART_MAGIC or version != CHART_VERSION:
+        return None
+    return list(CHART_NOTE.iter_unpack(data[CHART_HEADER.size:CHART_HEADER.size + count * CHART_NOTE.size]))
+
+
+def load_chart(song_path, difficulty, digest=None):
+    # Returns [(time_ms, lane), ...] sorted by time, or None if the song has no chart yet
+    if digest is None:
+        if not os.path.exists(song_path):
+            return None
+        digest = song_hash(song_path)
+    path = chart_path(song_path, difficulty, digest)
+    if not os.path.exists(path):
+        return None
+    return read_chart(path)
+
+
+def decode_song(song_path):
+    # Decode the whole song to mono float samples with the mixer
+    import pygame
+    import numpy as np
+
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    sample_rate = pygame.mixer.get_init()[0]
+    samples = pygame.sndarray.array(pygame.mixer.Sound(song_path)).astype(np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    return samples / 32768.0, sample_rate
+
+
+def detect_onsets(samples, sample_rate):
+    # Spectral flux onset detection, returns onset times (ms), strengths and spectral centroids
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    frames = sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE), axis=1))
+    spectrum = np.log1p(spectrum)
+
+    flux = np.maximum(spectrum[1:] - spectrum[:-1], 0).sum(axis=1)
+    flux = np.concatenate(([0.0], flux))
+    flux /= flux.max() or 1.0
+
+    # Peak picking: local maximum above a moving average threshold
+    window = 2 * THRESHOLD_WINDOW + 1
+    padded = np.pad(flux, THRESHOLD_WINDOW, mode="edge")
+    local_mean = np.convolve(padded, np.ones(window) / window, mode="valid")
+    local_max = sliding_window_view(np.pad(flux, 1, mode="edge"), 3).max(axis=1)
+    peaks = np.flatnonzero((flux >= local_max) & (flux > local_mean + THRESHOLD_DELTA))
+
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / sample_rate)
+    centroids = (spectrum[peaks] * freqs).sum(axis=1) / (spectrum[peaks].sum(axis=1) + 1e-9)
+    times = (peaks * HOP_SIZE + FRAME_SIZE // 2) * 1000 // sample_rate
+    return times.astype(np.int64), flux[peaks], centroids
+
+
+def build_chart(times, strengths, centroids, difficulty):
+    # Keep the strongest onsets that respect the difficulty's minimum gap
+    import numpy as np
+
+    min_gap = BASE_NOTE_GAP // difficulty
+    chosen = []
+    taken = np.zeros(0, dtype=np.int64)
+    for index in np.argsort(-strengths, kind="stable"):
+        time_ms = times[index]
+        position = np.searchsorted(taken, time_ms)
+        if position > 0 and time_ms - taken[position - 1] < min_gap:
+            continue
+        if position < len(taken) and taken[position] - time_ms < min_gap:
+            continue
+        taken = np.insert(taken, position, time_ms)
+        chosen.append(index)
+    chosen.sort()
+
+    # Lanes follow the pitch of the onset: low sounds on the left, high sounds on the right
+    if not chosen:
+        return []
+    chosen = np.array(chosen)
+    edges = np.quantile(centroids[chosen], np.linspace(0, 1, LANE_COUNT + 1)[1:-1])
+    lanes = np.searchsorted(edges, centroids[chosen])
+    return [(int(times[i]), int(lane)) for i, lane in zip(chosen, lanes)]
+
+
+def generate_charts(song_path, difficulties=DIFFICULTIES, force=False):
+    digest = song_hash(song_path)
+    missing = [d for d in difficulties if force or not os.path.exists(chart_path(song_path, d, digest))]
+    if not missing:
+        return []
+
+    samples, sample_rate = decode_song(song_path)
+    times, strengths, centroids = detect_onsets(samples, sample_rate)
+    written = []
+    for difficulty in missing:
+        path = chart_path(song_path, difficulty, digest)
+        write_chart(path, difficulty, build_chart(times, strengths, centroids, difficulty))
+        written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    # Usage: python charts.py [--force] [song.mp3 ...]   (defaults to every mp3 in this folder)
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    args = sys.argv[1:]
+    force = "--force" in args
+    song_paths = [arg for arg in args if arg != "--force"]
+    if not song_paths:
+        song_paths = sorted(name for name in os.listdir(".") if name.endswith(".mp3"))
+    for song_path in song_paths:
+        written = generate_charts(song_path, force=force)
+        if written:
+            for path in written:
+                print(f"{song_path}: wrote {path}")
+        else:
+            print(f"{song_path}: charts up to date")
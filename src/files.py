@@ -0,0 +1,23 @@
+import os
+from contextlib import contextmanager
+
+# Atomic file writes: the data goes to a temporary file next to the target,
+# is flushed to disk, then replaces the target in one step. A crash leaves
+# either the old file or the new one, never a half written one.
+
+
+@contextmanager
+def atomic_open(path, mode="wb"):
+    # For writers that stream into the file (seek, truncate, several writes)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode) as file:
+        yield file
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_atomic(path, data):
+    # data is str or bytes
+    with atomic_open(path, "w" if isinstance(data, str) else "wb") as file:
+        file.write(data)
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import wave
+import struct
+
+import charts
+from files import write_atomic
+
+# Song library: every audio file in a folder, with metadata cached in an index
+# file. A file is only read again when its size or modification time changed,
+# so starting with a big unchanged library costs one stat per song.
+LIBRARY_INDEX = "library.json"
+INDEX_VERSION = 1
+SONG_EXTENSIONS = (".mp3", ".ogg", ".wav")
+
+# MPEG audio frame headers: bitrates (kbps) by (version, layer) and sample rates by version
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_BITRATES[2, 3] = MP3_BITRATES[2, 2]
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def mp3_duration(path):
+    # From the Xing/Info frame count when there is one, otherwise assume a constant bitrate
+    with open(path, "rb") as file:
+        head = file.read(10)
+        start = 0
+        if head[:3] == b"ID3":
+            # Skip the ID3v2 tag, its size is stored in 7-bit bytes
+            start = 10 + ((head[6] & 0x7F) << 21 | (head[7] & 0x7F) << 14 | (head[8] & 0x7F) << 7 | (head[9] & 0x7F))
+        file.seek(start)
+        data = file.read(64 * 1024)
+    size = os.path.getsize(path) - start
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+            continue
+        header = struct.unpack(">I", data[i:i + 4])[0]
+        version = {3: 1, 2: 2, 0: 2.5}.get(header >> 19 & 3)
+        layer = 4 - (header >> 17 & 3)
+        bitrate_index = header >> 12 & 15
+        rate_index = header >> 10 & 3
+        if version is None or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        bitrate = MP3_BITRATES[min(version, 2), layer][bitrate_index] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        samples = 384 if layer == 1 else 1152 if version == 1 or layer == 2 else 576
+        mono = header >> 6 & 3 == 3
+        side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+        tag = i + 4 + side_info
+        if data[tag:tag + 4] in (b"Xing", b"Info") and data[tag + 7] & 1:
+            frames = struct.unpack(">I", data[tag + 8:tag + 12])[0]
+            return frames * samples * 1000 // sample_rate
+        return (size - i) * 8 * 1000 // bitrate
+    return None
+
+
+def ogg_duration(path):
+    # Last page's granule position (samples) over the rate in the Vorbis header
+    with open(path, "rb") as file:
+        head = file.read(64)
+        file.seek(max(0, os.path.getsize(path) - 64 * 1024))
+        tail = file.read()
+    marker = head.find(b"\x01vorbis")
+    last_page = tail.rfind(b"OggS")
+    if marker < 0 or last_page < 0:
+        return None
+    sample_rate = struct.unpack("<I", head[marker + 12:marker + 16])[0]
+    granule = struct.unpack("<q", tail[last_page + 6:last_page + 14])[0]
+    return granule * 1000 // sample_rate if sample_rate else None
+
+
+def wav_duration(path):
+    with wave.open(path) as file:
+        return file.getnframes() * 1000 // file.getframerate()
+
+
+def song_duration(path):
+    # Song length in ms, read from the file headers without decoding; None if unknown
+    readers = {".mp3": mp3_duration, ".ogg": ogg_duration, ".wav": wav_duration}
+    try:
+        return readers[os.path.splitext(path)[1].lower()](path)
+    except (OSError, EOFError, KeyError, IndexError, struct.error, wave.Error):
+        return None
+
+
+class SongLibrary:
+    def __init__(self, folder=".", index_path=LIBRARY_INDEX):
+        self.folder = folder
+        self.index_path = index_path
+        self.songs = []  # Song paths, sorted
+        self.entries = {}  # Song path -> {"size", "mtime", "hash", "duration", "charts"}
+
+    def scan(self):
+        # Returns how many songs were (re)read
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+            cached = index["songs"] if index.get("version") == INDEX_VERSION else {}
+        except (OSError, ValueError):
+            cached = {}
+
+        try:
+            names = sorted(os.listdir(self.folder))
+        except FileNotFoundError:
+            names = []  # A missing folder is an empty library, the menu says no songs were found
+        present = set(names)
+        entries = {}
+        refreshed = 0
+        for name in names:
+            if not name.lower().endswith(SONG_EXTENSIONS):
+                continue
+            path = os.path.normpath(os.path.join(self.folder, name))
+            stat = os.stat(path)
+            entry = dict(cached.get(path, {}))
+            if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime_ns:
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": charts.song_hash(path),
+                    "duration": song_duration(path),
+                }
+                refreshed += 1
+            # Charts are written separately from their song, look for them on every scan
+            entry["charts"] = [
+                difficulty for difficulty in charts.DIFFICULTIES
+                if os.path.basename(charts.chart_path(path, difficulty, entry["hash"])) in present
+            ]
+            entries[path] = entry
+
+        self.songs = list(entries)
+        if entries != cached:
+            self.write_index(entries)
+        self.entries = entries
+        return refreshed
+
+    def write_index(self, entries):
+        write_atomic(self.index_path, json.dumps({"version": INDEX_VERSION, "songs": entries}, separators=(",", ":")))
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def find(self, song):
+        # Index of a song path, or None
+        try:
+            return self.songs.index(os.path.normpath(song))
+        except ValueError:
+            return None
+
+    def info(self, song):
+        return self.entries[song]
+
+
+if __name__ == "__main__":
+    # Usage: python library.py [folder]   (builds or refreshes the index)
+    import time
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    start = time.perf_counter()
+    library = SongLibrary(folder)
+    refreshed = library.scan()
+    print(f"{len(library)} songs, {refreshed} read, {time.perf_counter() - start:.2f}s")
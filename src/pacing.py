@@ -0,0 +1,105 @@
+import time
+import statistics
+from collections import deque
+
+import pygame
+
+# Frame pacing: waits out the rest of each frame the way the chosen mode says
+# and keeps a rolling window of frame times for the statistics.
+#   sleep     pygame's Clock.tick; cheap, but the sleep can overshoot by a ms or two
+#   hybrid    sleeps until SPIN_MS before the deadline, then spins on the clock
+#   uncapped  no waiting at all
+#   vsync     no waiting here, display.flip waits for the refresh: program.init()
+#             opens a SCALED window with vsync, or falls back to hybrid without one
+PACING_MODES = ("sleep", "hybrid", "uncapped", "vsync")
+SPIN_MS = 2  # How early hybrid pacing wakes up to spin
+HISTORY_FRAMES = 3600  # A minute at 60 FPS, enough frames for a 0.1% low
+HISTOGRAM_BUCKETS = 100  # 1 ms each, the last one collects every slower frame
+MISSED_FRAME = 1.5  # A frame this many budgets long missed its slot
+
+
+class FramePacer:
+    def __init__(self, mode="sleep", frame_rate=60):
+        if mode not in PACING_MODES:
+            raise ValueError(f"Unknown frame pacing {mode!r}, expected one of: {', '.join(PACING_MODES)}")
+        self.mode = mode
+        self.frame_rate = frame_rate
+        self.budget = 1000 / frame_rate if frame_rate > 0 else 0  # ms per frame, 0 without a target
+        self.clock = pygame.time.Clock()
+        self.deadline = None  # perf_counter time the previous frame was scheduled to end
+        self.last = None  # perf_counter time the previous frame ended
+        self.frame_times = deque(maxlen=HISTORY_FRAMES)  # ms
+        self.histogram = [0] * HISTOGRAM_BUCKETS  # Frame counts of frame_times by whole ms
+        self.frames = 0
+        self.missed = 0
+
+    def tick(self):
+        # Ends the frame: waits as the mode says, returns the ms since the previous tick
+        if self.mode == "sleep":
+            self.clock.tick(self.frame_rate)
+        elif self.mode == "hybrid" and self.budget:
+            self.wait()
+        now = time.perf_counter()
+        elapsed = 0.0 if self.last is None else (now - self.last) * 1000
+        if self.last is not None:
+            self.record(elapsed)
+        self.last = now
+        return elapsed
+
+    def wait(self):
+        now = time.perf_counter()
+        budget = self.budget / 1000
+        target = now if self.deadline is None else self.deadline + budget
+        if now - target > budget:
+            target = now  # More than a frame late: start over instead of rushing to catch up
+        if target - now > SPIN_MS / 1000:
+            time.sleep(target - now - SPIN_MS / 1000)
+        while time.perf_counter() < target:
+            pass
+        self.deadline = target
+
+    def reset(self):
+        # Start over after the loop stopped ticking for a while, e.g. while idle
+        self.deadline = None
+        self.last = None
+        self.clock.tick()
+
+    def record(self, ms):
+        if len(self.frame_times) == HISTORY_FRAMES:
+            self.histogram[min(int(self.frame_times[0]), HISTOGRAM_BUCKETS - 1)] -= 1
+        self.frame_times.append(ms)
+        self.histogram[min(int(ms), HISTOGRAM_BUCKETS - 1)] += 1
+        self.frames += 1
+        if self.budget and ms > self.budget * MISSED_FRAME:
+            self.missed += 1
+
+    def low(self, fraction):
+        # Average FPS over the slowest fraction of the recent frames (0.01 is the 1% low)
+        slowest = sorted(self.frame_times, reverse=True)[:max(1, int(len(self.frame_times) * fraction))]
+        return 1000 * len(slowest) / sum(slowest) if sum(slowest) else 0.0
+
+    def stats(self):
+        # Frame-time statistics over the last HISTORY_FRAMES frames; missed and frames count the whole run,
+        # and every key is there (zeros) before the first frame has been timed.
+        result = {"mode": self.mode, "frame_rate": self.frame_rate, "frames": self.frames, "missed": self.missed,
+                  "fps": 0.0, "mean_ms": 0.0, "jitter_ms": 0.0, "low_1_fps": 0.0, "low_01_fps": 0.0, "histogram_ms": {}}
+        if self.frame_times:
+            mean_ms = statistics.fmean(self.frame_times)
+            result.update({
+                "fps": 1000 / mean_ms if mean_ms else 0.0,
+                "mean_ms": mean_ms,
+                "jitter_ms": statistics.pstdev(self.frame_times),
+                "low_1_fps": self.low(0.01),
+                "low_01_fps": self.low(0.001),
+                "histogram_ms": {bucket: count for bucket, count in enumerate(self.histogram) if count},
+            })
+        return result
+
+    def summary(self):
+        # Overlay lines
+        if not self.frame_times:
+            return [f"pacing {self.mode}"]
+        return [
+            f"pacing {self.mode} {self.frame_rate} FPS, missed {self.missed}",
+            f"1% low {self.low(0.01):.0f}, 0.1% low {self.low(0.001):.0f}",
+        ]
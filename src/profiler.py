@@ -0,0 +1,159 @@
+import json
+import time
+import pygame
+from collections import deque
+
+# Frame profiler: times named stages of each frame, draws an overlay with the
+# results and can record everything as a Chrome trace (chrome://tracing, Perfetto).
+# While disabled, stage() hands back one shared no-op object, so the
+# instrumentation can stay in the game loop.
+
+GRAPH_FRAMES = 240  # Frames shown in the frame-time graph
+OVERLAY_REFRESH_MS = 250  # How often the overlay numbers change
+SMOOTHING = 0.1  # Weight of the newest frame in the averaged stage times
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.overlay = False
+        self.trace = None  # [(name, start ns, duration ns), ...] while recording a trace
+        self.trace_path = None
+        self.origin = time.perf_counter_ns()
+        self.frame_start = None
+        self.frame_times = deque(maxlen=GRAPH_FRAMES)  # ms
+        self.current = {}  # Stage -> ns spent in the frame being measured
+        self.averages = {}  # Stage -> smoothed ms per frame
+        self.shown = []  # Overlay lines, refreshed every OVERLAY_REFRESH_MS
+        self.last_refresh = 0
+        self.font = None  # pygame's default font, plain and readable at small sizes
+
+    def update_enabled(self):
+        self.enabled = self.overlay or self.trace is not None
+        self.frame_start = None  # Don't count the time spent disabled as a frame
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.update_enabled()
+
+    def start_trace(self, path):
+        self.trace = []
+        self.trace_path = path
+        self.update_enabled()
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def add(self, name, start, end):
+        self.current[name] = self.current.get(name, 0) + end - start
+        if self.trace is not None:
+            self.trace.append((name, start, end - start))
+
+    def skip_frame(self):
+        # Forget when the current frame started, e.g. after the game loop slept
+        self.frame_start = None
+
+    def begin_frame(self):
+        now = time.perf_counter_ns()
+        if self.enabled and self.frame_start is not None:
+            self.end_frame(now)
+        self.frame_start = now
+
+    def end_frame(self, now):
+        self.frame_times.append((now - self.frame_start) / 1e6)
+        if self.trace is not None:
+            self.trace.append(("frame", self.frame_start, now - self.frame_start))
+        for name, spent in self.current.items():
+            ms = spent / 1e6
+            self.averages[name] = self.averages.get(name, ms) * (1 - SMOOTHING) + ms * SMOOTHING
+        # Stages that stopped running (e.g. after a state change) fade out of the overlay
+        for name in list(self.averages):
+            if name not in self.current:
+                self.averages[name] *= 1 - SMOOTHING
+                if self.averages[name] < 0.005:
+                    del self.averages[name]
+        self.current.clear()
+
+    def fps(self):
+        if not self.frame_times:
+            return 0.0
+        return 1000 * len(self.frame_times) / sum(self.frame_times)
+
+    def draw(self, screen, text_cache, status=None):
+        # Panel with FPS, the frame-time graph and the averaged stage timings.
+        # status returns extra lines for the panel, called when the numbers refresh.
+        if not self.overlay:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 22)
+        now = time.perf_counter_ns() // 1_000_000
+        if now - self.last_refresh >= OVERLAY_REFRESH_MS:
+            self.last_refresh = now
+            self.shown = [f"FPS {self.fps():.0f}"]
+            if status is not None:
+                self.shown += status()
+            self.shown += [f"{name} {ms:.2f} ms" for name, ms in sorted(self.averages.items())]
+
+        width, line_height = 300, 18
+        graph_height = 60
+        panel = pygame.Rect(screen.get_width() - width - 10, 10, width, graph_height + len(self.shown) * line_height + 20)
+        screen.fill((0, 0, 0), panel)
+
+        # Frame-time graph, the line marks 16.7 ms (60 FPS)
+        graph = pygame.Rect(panel.x + 5, panel.y + 5, width - 10, graph_height)
+        scale = graph_height / 50  # 50 ms fills the graph
+        budget_y = graph.bottom - int(1000 / 60 * scale)
+        pygame.draw.line(screen, (100, 130, 120), (graph.x, budget_y), (graph.right, budget_y))
+        if len(self.frame_times) > 1:
+            step = graph.width / (GRAPH_FRAMES - 1)
+            points = [(graph.x + i * step, graph.bottom - min(graph_height, ms * scale)) for i, ms in enumerate(self.frame_times)]
+            pygame.draw.lines(screen, (0, 255, 0), False, points)
+
+        y = graph.bottom + 10
+        for line in self.shown:
+            screen.blit(text_cache.render(self.font, line, (255, 255, 255)), (panel.x + 5, y))
+            y += line_height
+
+    def write_trace(self):
+        # Chrome trace event format, timestamps in microseconds
+        if self.trace is None:
+            return
+        events = [
+            {"name": name, "ph": "X", "ts": (start - self.origin) / 1000, "dur": duration / 1000, "pid": 1, "tid": 1}
+            for name, start, duration in self.trace
+        ]
+        with open(self.trace_path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+# Shared profiler used by the game loop
+profiler = Profiler()
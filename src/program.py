@@ -1,32 +1,110 @@
+import time
+# Startup timing starts before the imports, pygame's is the biggest cold-start cost
+startup_start = time.perf_counter()
 import pygame
 from pygame.locals import *
 import random
 import os
-import json
-
-# Initialize Pygame
-pygame.init()
+import io
+import sys
+import threading
+import warnings
+import argparse
+from collections import deque, OrderedDict
+from assets import assets, text_cache, pack_name, SpriteAtlas
+import charts
+from scores import ScoreBook
+from library import SongLibrary
+from profiler import profiler
+from replay import Recording
+from pacing import FramePacer, PACING_MODES
+from settings import load_settings, save_settings, parse_size
+import audio
+
+# Startup timing: (stage, ms since the module started importing)
+startup_times = []
+
+def mark_startup(stage):
+    startup_times.append((stage, (time.perf_counter() - startup_start) * 1000))
+
+settings = load_settings()
+
+# Screen dimensions: the game draws at WIDTH x HEIGHT (see set_render_size)
+# and the frame is scaled to the window when their sizes differ
+screen = None  # What the game draws to, created by init()
+window = None  # The display surface
+present_rect = None  # Where the frame goes in the window
+
+# Initialize only what the menu needs; the mixer starts with the first song,
+# fonts load on first use and the character is built when a game starts.
+# vsync asks for a window whose flip waits for the display refresh; returns
+# whether it got one.
+def init(vsync=False):
+    mark_startup("imports")
+    pygame.display.init()
+    pygame.font.init()
+    mark_startup("pygame")
+    if vsync:
+        # pygame only honours vsync with SCALED (or OpenGL): SDL then scales
+        # the render size to the window, so present() has nothing to do
+        os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "linear" if settings["smooth_scaling"] else "nearest")
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                pygame.display.set_mode((WIDTH, HEIGHT), SCALED | RESIZABLE, vsync=1)
+            # Without a hardware renderer pygame falls back to a plain window, no vsync
+            vsync = not any("renderer" in str(warning.message) for warning in caught)
+        except pygame.error:
+            vsync = False
+    if not vsync:
+        pygame.display.set_mode(settings["window_size"], HWSURFACE | DOUBLEBUF | RESIZABLE)
+    pygame.display.set_caption("Chorão")
+    resize_window()
+    mark_startup("window")
+    # Pre-scaled assets for the render resolution, made by bake.py (optional)
+    pack_file = f"assets-{WIDTH}x{HEIGHT}.pack"
+    if os.path.exists(pack_file):
+        assets.open_pack(pack_file)
+        mark_startup("asset pack")
+    score_book.open()
+    mark_startup("scores")
+    library.scan()
+    mark_startup("songs")
+    return vsync
+
+def resize_window():
+    # Called at startup and when the window is resized. The game draws straight
+    # to the window while it matches the render size, otherwise to an offscreen
+    # surface that present() scales to fit the window.
+    global screen, window, present_rect
+    window = pygame.display.get_surface()
+    window_width, window_height = window.get_size()
+    scale = min(window_width / WIDTH, window_height / HEIGHT)
+    present_rect = pygame.Rect(0, 0, round(WIDTH * scale), round(HEIGHT * scale))
+    present_rect.center = (window_width // 2, window_height // 2)
+    if window.get_size() == (WIDTH, HEIGHT):
+        screen = window
+    else:
+        if screen is None or screen is window:
+            screen = pygame.Surface((WIDTH, HEIGHT)).convert()
+        window.fill((0, 0, 0))  # Borders around a frame with another aspect ratio
 
-# Screen dimensions
-WIDTH, HEIGHT = 1280, 720
-screen = pygame.display.set_mode((WIDTH, HEIGHT), HWSURFACE | DOUBLEBUF | RESIZABLE)
-pygame.display.set_caption("Chorão")
+def present():
+    # Scale the finished frame to the window, once per frame
+    if screen is not window:
+        scale = pygame.transform.smoothscale if settings["smooth_scaling"] else pygame.transform.scale
+        scale(screen, present_rect.size, window.subsurface(present_rect))
 
-# File to save high scores
-SCORE_FILE = "high_scores.json"
+def init_mixer():
+    # Explicit format and buffer size, the buffer decides most of the output latency
+    if not pygame.mixer.get_init():
+        pygame.mixer.init(frequency=settings["audio_frequency"], size=-16, channels=2, buffer=settings["audio_buffer"])
 
-# Load high scores from file
-def load_high_scores():
-    if os.path.exists(SCORE_FILE):
-        with open(SCORE_FILE, "r") as file:
-            return json.load(file)
-    else:
-        return {song: 0 for song in songs}
+def startup_report():
+    return "Startup (ms): " + ", ".join(f"{stage} {ms:.0f}" for stage, ms in startup_times)
 
-# Save high scores to file
-def save_high_scores():
-    with open(SCORE_FILE, "w") as file:
-        json.dump(high_scores, file)
+# Run history and best scores, saved on a background thread
+score_book = ScoreBook()
 
 # Colors
 WHITE = (255, 255, 255)
@@ -39,55 +117,154 @@ YELLOW = (255, 255, 0)  # Highlight color
 
 MUSIC_MAX_TIME = 180_000  # For example, 180 seconds
 
+# Timing: the simulation runs at a fixed rate, rendering as fast as the frame pacer allows
+TICK_RATE = 60  # Simulation steps per second
+TICK_MS = 1000 / TICK_RATE
+MAX_FRAME_MS = 250  # Longest frame we catch up on, so a stall doesn't freeze the game
+IDLE_WAIT_MS = 250  # While idle the loop sleeps in pygame.event.wait for at most this long
+MENU_IDLE_SECONDS = 30  # The menu stops animating after this long without input
+
+# Loads the font file the first time text is rendered with it
+class LazyFont:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.font = None
+
+    def render(self, *args):
+        if self.font is None:
+            self.font = pygame.font.Font(self.path, self.size)
+        return self.font.render(*args)
+
 # Load custom font
 custom_font_path = "RockSalt-Regular.ttf"  
-font_large = pygame.font.Font(custom_font_path, 64)
-font_medium = pygame.font.Font(custom_font_path, 32)
 
-# Font
-font = pygame.font.Font(custom_font_path, 22)
-small_font = pygame.font.Font(custom_font_path, 16)
+# Layout: lengths are designed for a 720 pixel high screen and scaled to the render resolution
+DESIGN_HEIGHT = 720
+
+def px(length):
+    return round(length * HEIGHT / DESIGN_HEIGHT)
 
 # Lanes and positions
-lanes = [150, 250, 350, 450]  # Corresponding to a, s, k, l
 keys = [0, 1, 2, 3]
-note_speed = 5
-striking_zone_height = 100  # Height of the striking zone
-striking_zone_y = HEIGHT - striking_zone_height
+# ms from spawn to the striking zone: 5 pixels per simulation step over the
+# design screen, so the timing is the same at every render resolution
+note_travel_time = (DESIGN_HEIGHT - 100 + 50) / (5 / TICK_MS)
+
+def set_render_size(width, height):
+    # Internal resolution and everything laid out from it; call before init()
+    global WIDTH, HEIGHT, lanes, arrow_size, note_speed_ms, note_start_y, striking_zone_height, striking_zone_y
+    global font_large, font_medium, font, small_font, dissipate_strips, lane_sprites
+    WIDTH, HEIGHT = width, height
+    lanes = [px(x) for x in (150, 250, 350, 450)]  # Corresponding to a, s, k, l
+    arrow_size = (px(50), px(50))
+    note_start_y = -arrow_size[1]
+    striking_zone_height = px(100)  # Height of the striking zone
+    striking_zone_y = HEIGHT - striking_zone_height
+    note_speed_ms = (striking_zone_y - note_start_y) / note_travel_time  # Pixels per millisecond
+
+    font_large = LazyFont(custom_font_path, px(64))
+    font_medium = LazyFont(custom_font_path, px(32))
+    font = LazyFont(custom_font_path, px(22))
+    small_font = LazyFont(custom_font_path, px(16))
+    dissipate_strips = {}  # Sized for the old resolution
+    lane_sprites = None
+
+set_render_size(*settings["render_size"])
+
+# Hit windows in ms, measured from a note's target time (when it reaches the striking zone)
+judge_windows = {
+    "good": 80,  # Pressed within this many ms of the target
+    "half": 160,  # Within this many ms, but not good
+    "early": note_travel_time,  # Pressed before the half window while the note is on screen
+    "miss": 160,  # A note this late without a press is missed
+}
+AUDIO_RESYNC_MS = 250  # Game time jumps to the audio clock if they drift this far apart
+AUDIO_SLEW = 0.05  # Otherwise game time moves this fraction of the drift towards it per step
+AUDIO_DEADBAND_MS = 10  # Smaller drift is audio clock jitter and is left alone
+
+# Audio calibration: the player taps along to a click track and the median
+# distance from the clicks becomes settings["audio_offset_ms"]
+CALIBRATION_BEAT_MS = 600
+CALIBRATION_BEATS = 24
+CALIBRATION_MIN_TAPS = 8
+CALIBRATION_MAX_OFFSET = 250  # Taps further than this from every click are ignored
+
+# Grade for a key press offset ms from the note's target time (negative is early)
+def judge_offset(offset):
+    if abs(offset) <= judge_windows["good"]:
+        return "good"
+    if abs(offset) <= judge_windows["half"]:
+        return "half"
+    if offset < 0:
+        return "early" if -offset <= judge_windows["early"] else None
+    return "miss"
+
+# Timing error of the hits in one session
+class TimingStats:
+    def __init__(self):
+        self.counts = {"early": 0, "good": 0, "half": 0, "miss": 0}
+        self.offsets = []  # Offsets (ms) of the good and half hits
+
+    def add(self, grade, offset=None):
+        self.counts[grade] += 1
+        if grade in ("good", "half"):
+            self.offsets.append(offset)
+
+    def mean(self):
+        return sum(self.offsets) / len(self.offsets) if self.offsets else 0.0
+
+    def stddev(self):
+        if len(self.offsets) < 2:
+            return 0.0
+        mean = self.mean()
+        return (sum((offset - mean) ** 2 for offset in self.offsets) / (len(self.offsets) - 1)) ** 0.5
+
+    def summary(self):
+        return f"Timing: mean {self.mean():+.0f} ms, stddev {self.stddev():.0f} ms over {len(self.offsets)} hits"
 
 # Scoring and combo variables
 score = 0
 combo = 0
 combo_streak = 0  # Tracks correct hits in a row
-
-# Music list and high scores dictionary
-songs = ["musica1.mp3", "musica2.mp3", "musica3.mp3"]
-high_scores = load_high_scores()
-current_song = songs[0]
-
-# Function to find the next note in the lane
-def find_next_note_in_lane(lane_key, notes):
-    for note in notes:
-        if note.key == lane_key and not note.hit:
-            return note
-    return None
-
-# Draw the fixed blocks
-def draw_fixed_arrows():
-    original_arrow = pygame.transform.scale(pygame.image.load("Sprites/setas/seta_padrao.png"), (50, 50))
-    arrows = [ 
-        pygame.transform.rotate(original_arrow, 90),    # Left
-        pygame.transform.rotate(original_arrow, 180),   # Down
-        original_arrow,                                 # Up  
-        pygame.transform.rotate(original_arrow, -90)    # Right
-    ]
-    for i, lane in enumerate(lanes):
-        arrow_rect = arrows[i].get_rect(center=(lane + 25, HEIGHT - striking_zone_height + 25))
-        screen.blit(arrows[i], arrow_rect)
+max_combo = 0  # Longest streak of the current run
+
+# Every song in the song folder, scanned by init()
+library = SongLibrary(settings["song_folder"])
+current_song = None
+MENU_SONG_ROWS = 3  # Songs shown at once in the menu list
+MENU_PAGE = 10  # Songs skipped by Page Up / Page Down
+PRELOAD_DELAY = 0.15  # Seconds the selection must rest on a song before its phase is loaded
+
+# Lane lines and fixed arrows as (surface, position) lists for Surface.blits,
+# built once per render size
+lane_sprites = None
+
+def lane_batches():
+    global lane_sprites
+    if lane_sprites is None:
+        line = pygame.Surface((max(1, px(2)), HEIGHT))
+        line.fill(WHITE)
+        # Same columns pygame.draw.line covers for a line of that width
+        lines = [(line, (lane + arrow_size[0] // 2 - (line.get_width() - 1) // 2, 0)) for lane in lanes]
+
+        arrow_path = fixed_arrow
+        arrows = [ 
+            assets.image(arrow_path, arrow_size, rotation=90),    # Left
+            assets.image(arrow_path, arrow_size, rotation=180),   # Down
+            assets.image(arrow_path, arrow_size),                 # Up  
+            assets.image(arrow_path, arrow_size, rotation=-90)    # Right
+        ]
+        fixed = [
+            (arrow, arrow.get_rect(center=(lane + arrow_size[0] // 2, striking_zone_y + arrow_size[1] // 2)))
+            for arrow, lane in zip(arrows, lanes)
+        ]
+        lane_sprites = (lines, fixed)
+    return lane_sprites
 
 # Modify the score calculation logic
 def calculate_score(note, accuracy):
-    global score, combo, combo_streak
+    global score, combo, combo_streak, max_combo
 
     # Adjust base score increments and decrements for fairness
     if accuracy == "early":
@@ -107,6 +284,7 @@ def calculate_score(note, accuracy):
         # Positive combo for correct hits, capped at 5x multiplier
         combo_streak += 1
         combo = min(combo_streak, 5)  # Cap the positive combo at 5
+        max_combo = max(max_combo, combo_streak)
     else:
         # Negative combo for misses; increases penalty with more misses
         combo_streak = 1
@@ -115,307 +293,911 @@ def calculate_score(note, accuracy):
     # Update score based on combo
     score += score_increase * abs(combo)  # Use absolute value of combo for consistency
 
+# Arrow sprites for each lane
+note_arrows = [
+    "Sprites/setas/seta_esquerda.png",
+    "Sprites/setas/seta_baixo.png",
+    "Sprites/setas/seta_cima.png",
+    "Sprites/setas/seta_direita.png",
+]
+fixed_arrow = "Sprites/setas/seta_padrao.png"
+
+# Dissipation effect: every step grows the circle and fades it out
+DISSIPATE_RADIUS = 25
+DISSIPATE_GROWTH = 2
+DISSIPATE_FADE = 15
+DISSIPATE_STEPS = 255 // DISSIPATE_FADE  # Steps until the circle is fully transparent
+
+# Pre-rendered dissipation frames, one strip per color
+dissipate_strips = {}
+
+def dissipate_frames(color):
+    frames = dissipate_strips.get(color)
+    if frames is None:
+        frames = []
+        for step in range(DISSIPATE_STEPS + 1):
+            radius = px(DISSIPATE_RADIUS + step * DISSIPATE_GROWTH)
+            alpha = max(0, 255 - step * DISSIPATE_FADE)
+            frame = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(frame, color + (alpha,), (radius, radius), radius)
+            frames.append(frame)
+        dissipate_strips[color] = frames
+    return frames
+
 class Note:
-    def __init__(self, lane, key):
-        self.radius = 25  # Radius of the circle note
-        self.rect = pygame.Rect(lane, -50, self.radius * 2, self.radius * 2)
+    __slots__ = ("radius", "rect", "hit", "key", "spawn_time", "dissipate_step", "dissipate_color", "current_arrow")
+
+    def __init__(self, lane, key, spawn_time=0):
+        self.radius = arrow_size[0] // 2  # Radius of the circle note
+        self.rect = pygame.Rect(lane, note_start_y, self.radius * 2, self.radius * 2)
+        self.reset(lane, key, spawn_time)
+
+    def reset(self, lane, key, spawn_time=0):
+        # Put the note back at the top of its lane (used when recycling from the pool)
+        self.rect.topleft = (lane, note_start_y)
         self.hit = False
         self.key = key
-        self.dissipating = False
-        self.alpha = 255
-        self.size_decrease_rate = 2
+        self.spawn_time = spawn_time  # Game time (ms) when the note left the top of the lane
+        self.dissipate_step = 0  # Index into the dissipation frame strip, 0 while not dissipating
         self.dissipate_color = RED
 
-        # Load arrow sprites for each lane
-        self.arrow_sprites = [
-            pygame.transform.scale(pygame.image.load("Sprites/setas/seta_esquerda.png"), (50, 50)),
-            pygame.transform.scale(pygame.image.load("Sprites/setas/seta_baixo.png"), (50, 50)),
-            pygame.transform.scale(pygame.image.load("Sprites/setas/seta_cima.png"), (50, 50)),
-            pygame.transform.scale(pygame.image.load("Sprites/setas/seta_direita.png"), (50, 50))
-        ]
-        self.current_arrow = self.arrow_sprites[key]
+        # Arrow sprite for this lane, shared by every note through the asset cache
+        self.current_arrow = assets.image(note_arrows[key], arrow_size)
+
+    def target_time(self):
+        # Game time when the note reaches the striking zone
+        return self.spawn_time + note_travel_time
 
-    def fall(self):
+    def y_at(self, time):
+        # The position comes from the spawn time, so dropped frames never slow the notes down
+        return note_start_y + (time - self.spawn_time) * note_speed_ms
+
+    def fall(self, time):
         if not self.hit:
-            self.rect.y += note_speed
+            self.rect.y = int(self.y_at(time))
 
     def dissipate(self):
-        if self.dissipating:
-            self.radius += self.size_decrease_rate
-            self.alpha = max(0, self.alpha - 15)
-            if self.alpha <= 0:
+        if self.hit:
+            self.dissipate_step = min(self.dissipate_step + 1, DISSIPATE_STEPS)
+            if self.dissipate_step >= DISSIPATE_STEPS:
                 return True
         return False
 
-    def draw(self, screen):
-        if not self.dissipating:
-            # Draw the note with the arrow sprite
-            screen.blit(self.current_arrow, (self.rect.x, self.rect.y))
+# Holds the notes on screen: one FIFO queue of unjudged notes per lane,
+# the judged notes that are still dissipating, and a pool of free notes
+class NoteStore:
+    def __init__(self, lane_count=4):
+        self.lanes = [deque() for _ in range(lane_count)]
+        self.judged = deque()
+        self.pool = []
+
+    def spawn(self, lane, key, spawn_time):
+        if self.pool:
+            note = self.pool.pop()
+            note.reset(lane, key, spawn_time)
         else:
-            # Create a temporary surface for the dissipating note
-            dissipate_surface = pygame.Surface((self.radius * 2, self.radius * 2), pygame.SRCALPHA)
-            color = self.dissipate_color + (self.alpha,)
-            pygame.draw.circle(dissipate_surface, color, (self.radius, self.radius), self.radius)
-            # Position and draw the dissipating circle
-            dissipate_x = self.rect.x + self.rect.width // 2 - self.radius
-            dissipate_y = self.rect.y + self.rect.height // 2 - self.radius
-            screen.blit(dissipate_surface, (dissipate_x, dissipate_y))
-
-        if self.hit and not self.dissipating:
-            self.dissipating = True
-
+            note = Note(lane, key, spawn_time)
+        self.lanes[key].append(note)
+        return note
+
+    def next_in_lane(self, key):
+        # Notes in a lane fall at the same speed, so the oldest one is always the next to judge
+        queue = self.lanes[key]
+        return queue[0] if queue else None
+
+    def judge(self, note):
+        note.hit = True
+        queue = self.lanes[note.key]
+        if queue and queue[0] is note:
+            queue.popleft()
+        else:
+            queue.remove(note)
+        self.judged.append(note)
+
+    def release_finished(self, count):
+        # Judged notes finish dissipating in the order they were judged
+        for _ in range(count):
+            self.pool.append(self.judged.popleft())
+
+    def clear(self):
+        for queue in self.lanes:
+            self.pool.extend(queue)
+            queue.clear()
+        self.pool.extend(self.judged)
+        self.judged.clear()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.lanes) + len(self.judged)
+
+
+# Character sprite sheets: (file, frame width, frame height, number of frames)
+cryer_animations = {
+    "start_walk": ("Sprites/cryer/Comeco_andar.png", 616, 192, 11),
+    "walk": ("Sprites/cryer/Andando.png", 616, 192, 12),
+    "jump": ("Sprites/cryer/Pulando.png", 616, 192, 11),
+    "crouch": ("Sprites/cryer/Abaixa.png", 616, 192, 6),
+    "trick1": ("Sprites/cryer/Manobra_baixo.png", 616, 192, 8),
+}
+cryer_scale = 1.3
+cryer_flipped = {"trick2": "trick1"}  # Mirrored animations, built once from another one
+CRYER_FRAME_MS = 5 * TICK_MS  # Each animation frame stays up for 5 simulation steps
+cryer_atlas = None
+
+def cryer_frame_size(frame_width, frame_height):
+    scale = cryer_scale * HEIGHT / DESIGN_HEIGHT
+    return (int(frame_width * scale), int(frame_height * scale))
+
+def load_cryer_atlas():
+    # All character frames in one atlas, built on first use and shared
+    global cryer_atlas
+    if cryer_atlas is None:
+        animations = {}
+        for name, (file_path, frame_width, frame_height, num_frames) in cryer_animations.items():
+            size = cryer_frame_size(frame_width, frame_height)
+            animations[name] = [
+                assets.frame(file_path, i, (frame_width, frame_height), size, keep=False) for i in range(num_frames)
+            ]
+            assets.discard(file_path)  # The atlas holds the frames, the full sheet isn't needed again
+        cryer_atlas = SpriteAtlas(animations, cryer_flipped)
+    return cryer_atlas
 
 class BigCryer:
     def __init__(self):
-        self.x = 300
-        self.y = 400
+        self.x = px(300)
+        self.y = px(400)
         self.hit = False
         self.jump_height = 5
-        self.animations = {
-            "start_walk": self.load_animation("Sprites/cryer/Comeco_andar.png", 616, 192, 11),
-            "walk": self.load_animation("Sprites/cryer/Andando.png", 616, 192, 12),
-            "jump": self.load_animation("Sprites/cryer/Pulando.png", 616, 192, 11),
-            "crouch": self.load_animation("Sprites/cryer/Abaixa.png", 616, 192, 6),
-            "trick1": self.load_animation("Sprites/cryer/Manobra_baixo.png", 616, 192, 8),
-            "trick2": self.load_animation("Sprites/cryer/Manobra_baixo.png", 616, 192, 8),
-        }
-        self.animations["trick2"] = [pygame.transform.flip(frame, True, False) for frame in self.animations["trick1"]]
+        self.atlas = load_cryer_atlas()
         self.current_animation = "start_walk"
-        self.current_frame = 0
-        self.frame_counter = 0
-        self.frame_delay = 5
-
-    def load_animation(self, file_path, frame_width, frame_height, num_frames):
-        animation = []
-        sprite_sheet = pygame.image.load(file_path).convert_alpha()
-        for i in range(num_frames):
-            frame = sprite_sheet.subsurface((0, i*frame_height, frame_width, frame_height))
-            frame = pygame.transform.scale(frame, (frame_width * 1.3, frame_height * 1.3))
-            animation.append(frame)
-        return animation
-
-    def set_animation(self, action):
+        self.animation_start = None  # Time (ms) the current animation started, set on the first draw
+
+    def set_animation(self, action, now):
         if action != self.current_animation:
             self.current_animation = action
-            self.current_frame = 0
-
-    def update(self, screen):
-        self.frame_counter += 1
-        if self.frame_counter >= self.frame_delay:
-            self.frame_counter = 0
-            self.current_frame += 1
-            
-            # Se a animação for apenas uma vez e estiver no último quadro
-            if self.current_animation != "walk" and self.current_frame >= len(self.animations[self.current_animation]):
-                self.set_animation("walk")  # Volta para a animação "walk"
-            else:
-                # Garante que a animação continua a se repetir caso não seja "once"
-                self.current_frame %= len(self.animations[self.current_animation])
-        
-        current_frame_image = self.animations[self.current_animation][self.current_frame]
-        screen.blit(current_frame_image, (self.x, self.y))
+            self.animation_start = now
+
+    def current_frame(self, now):
+        if self.animation_start is None:
+            self.animation_start = now
+        frame = int((now - self.animation_start) // CRYER_FRAME_MS)
+        count = self.atlas.count(self.current_animation)
+        # Se a animação for apenas uma vez e estiver no último quadro, volta para a animação "walk"
+        if self.current_animation != "walk" and frame >= count:
+            self.animation_start += count * CRYER_FRAME_MS
+            self.current_animation = "walk"
+            return self.current_frame(now)
+        return frame % count
+
+    def draw(self, screen, now):
+        frame = self.current_frame(now)
+        self.atlas.blit(screen, self.current_animation, frame, (self.x, self.y))
 
 class BackgroundLayer:
     def __init__(self, image_path, speed):
-        self.image = pygame.image.load(image_path).convert_alpha()
-        self.image = pygame.transform.scale(self.image, (WIDTH, HEIGHT))
+        image = assets.image(image_path, (WIDTH, HEIGHT))
+        self.width = image.get_width()
+
+        # Fully opaque layers (like the sky) are blitted without alpha blending
+        self.opaque = pygame.mask.from_surface(image, 254).count() == image.get_width() * image.get_height()
+        if self.opaque:
+            image = image.convert()
+            self.y = 0
+        else:
+            # Keep only the rows that have visible pixels
+            bounds = image.get_bounding_rect()
+            self.y = bounds.y
+            image = image.subsurface((0, bounds.y, self.width, bounds.height)).copy()
+        self.image = image
+
         self.x1 = 0
-        self.x2 = self.image.get_width()
+        self.x2 = self.width
         self.speed = speed
 
-    def update(self, screen):
+    def step(self):
+        # Scroll by speed pixels per simulation step
         self.x1 -= self.speed
         self.x2 -= self.speed
 
-        if self.x1 + self.image.get_width() < 0:
-            self.x1 = self.x2 + self.image.get_width()
-        if self.x2 + self.image.get_width() < 0:
-            self.x2 = self.x1 + self.image.get_width()
+        if self.x1 + self.width < 0:
+            self.x1 = self.x2 + self.width
+        if self.x2 + self.width < 0:
+            self.x2 = self.x1 + self.width
+
+    def draw(self, screen, alpha=0):
+        # alpha is how far we are into the next simulation step (0..1)
+        offset = int(self.speed * alpha)
+        screen.blit(self.image, (self.x1 - offset, self.y))
+        screen.blit(self.image, (self.x2 - offset, self.y))
+
+# Stack of parallax layers, back to front. Layers that stopped scrolling at the
+# back of the stack are merged into one cached surface and blitted once.
+class ParallaxBackground:
+    def __init__(self, layers):
+        self.layers = layers
+        self.speeds = [layer.speed for layer in layers]
+        self.merged = None
+        self.merged_key = None
+
+    def pause(self):
+        for layer in self.layers:
+            layer.speed = 0
+
+    def resume(self):
+        for layer, speed in zip(self.layers, self.speeds):
+            layer.speed = speed
+
+    def step(self):
+        for layer in self.layers:
+            if layer.speed:
+                layer.step()
+
+    def stopped_layers(self):
+        count = 0
+        for layer in self.layers:
+            if layer.speed:
+                break
+            count += 1
+        return count
+
+    def draw(self, screen, alpha=0):
+        stopped = self.stopped_layers()
+        if stopped > 1:
+            key = (stopped, tuple((layer.x1, layer.x2) for layer in self.layers[:stopped]))
+            if key != self.merged_key:
+                self.merged = self.merge(self.layers[:stopped])
+                self.merged_key = key
+            screen.blit(self.merged, (0, 0))
+        else:
+            stopped = 0
+        for layer in self.layers[stopped:]:
+            layer.draw(screen, alpha)
 
-        screen.blit(self.image, (self.x1, 0))
-        screen.blit(self.image, (self.x2, 0))
+    def merge(self, layers):
+        if layers[0].opaque:
+            merged = pygame.Surface((WIDTH, HEIGHT)).convert()
+        else:
+            merged = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA).convert_alpha()
+        for layer in layers:
+            layer.draw(merged)
+        return merged
+
+# Background layers for each phase, back to front (-1 is the menu)
+phase_layers = {
+    0: [
+        "Sprites/bg/fase1/Sky.png",
+        "Sprites/bg/fase1/back.png",
+        "Sprites/bg/fase1/houses3.png",
+        "Sprites/bg/fase1/houses1.png",
+        "Sprites/bg/fase1/minishop&callbox.png",
+        "Sprites/bg/fase1/road&lamps.png",
+    ],
+    1: [
+        "Sprites/bg/fase2/1.png",
+        "Sprites/bg/fase2/2.png",
+        "Sprites/bg/fase2/3.png",
+        "Sprites/bg/fase2/4.png",
+        "Sprites/bg/fase2/5.png",
+        "Sprites/bg/fase2/7.png",
+        "Sprites/bg/fase2/road2.png",
+    ],
+    2: [
+        "Sprites/bg/fase3/Sky.png",
+        "Sprites/bg/fase3/houses.png",
+        "Sprites/bg/fase3/houses2.png",
+        "Sprites/bg/fase3/fountain&bush.png",
+        "Sprites/bg/fase3/houses1.png",
+        "Sprites/bg/fase3/umbrella&policebox.png",
+        "Sprites/bg/fase3/road.png",
+    ],
+    -1: [
+        "Sprites/bg/menu/Sky.png",
+        "Sprites/bg/menu/buildings.png",
+        "Sprites/bg/menu/wall2.png",
+        "Sprites/bg/menu/wall1.png",
+        "Sprites/bg/menu/boxes&container.png",
+        "Sprites/bg/menu/wheels&hydrant.png",
+        "Sprites/bg/menu/road&border.png",
+    ],
+}
+
+# A phase being loaded in the background: decoded layers, the song's bytes and timings
+class PhaseJob:
+    def __init__(self, phase, song):
+        self.phase = phase
+        self.song = song
+        self.paths = phase_layers[phase]
+        self.surfaces = {}  # path -> scaled surface, converted once the main thread takes it
+        self.converted = False
+        self.music = None  # Raw bytes of the song
+        self.decoded = None  # The song decoded to WAV bytes, so playback starts without decoding
+        self.decode_started = False
+        self.decode_done = threading.Event()
+        self.digest = None  # Content hash of the song, used to find its charts
+        self.error = None
+        self.done = threading.Event()
+        self.requested = time.perf_counter()
+        self.timings = {}
+
+    def progress(self):
+        return (len(self.surfaces) + (self.music is not None)) / (len(self.paths) + 1)
+
+    # Playing only needs the layers and the song bytes: the decoded song is used
+    # if it is finished by then, otherwise the compressed bytes are streamed
+    def ready(self):
+        return self.done.is_set()
+
+    def wait(self):
+        self.done.wait()
+
+# Songs take turns using the gameplay phases (-1 is the menu)
+game_phases = sorted(phase for phase in phase_layers if phase >= 0)
+
+def song_phase(index):
+    return game_phases[index % len(game_phases)]
+
+MAX_PHASE_JOBS = 4  # Loaded phases kept around, the least recently requested go first
+
+# Decodes phases on a worker thread as soon as their song is highlighted in the menu.
+# Songs are decoded too once the mixer is up, its format is needed for that.
+class PhaseLoader:
+    def __init__(self):
+        self.jobs = OrderedDict()  # (phase, song) -> PhaseJob, oldest request first
+        self.decode_audio = False
+
+    def preload(self, phase, song):
+        job = self.jobs.get((phase, song))
+        if job is None:
+            job = PhaseJob(phase, song)
+            # Another song on the same phase already has its layers
+            for other in self.jobs.values():
+                if other.phase == phase and other.done.is_set() and other.error is None:
+                    job.surfaces = dict(other.surfaces)
+                    break
+            self.jobs[phase, song] = job
+            threading.Thread(target=self.work, args=(job,), daemon=True).start()
+            if len(self.jobs) > MAX_PHASE_JOBS:
+                self.jobs.popitem(last=False)
+        else:
+            self.jobs.move_to_end((phase, song))
+        if self.decode_audio and not job.decode_started:
+            self.release_audio(job)
+            job.decode_started = True
+            threading.Thread(target=self.decode, args=(job,), daemon=True).start()
+        return job
+
+    def work(self, job):
+        try:
+            for path in job.paths:
+                if path in job.surfaces:
+                    continue
+                surface = assets.pack_surface(pack_name(path, (WIDTH, HEIGHT)))
+                if surface is None:
+                    surface = pygame.transform.scale(pygame.image.load(path), (WIDTH, HEIGHT))
+                job.surfaces[path] = surface
+            job.timings["decode_ms"] = (time.perf_counter() - job.requested) * 1000
+            with open(job.song, "rb") as file:
+                job.music = file.read()
+            job.digest = charts.data_hash(job.music)
+        except (OSError, pygame.error) as error:
+            job.error = error
+        job.timings["ready_ms"] = (time.perf_counter() - job.requested) * 1000
+        job.done.set()
+
+    def decode(self, job):
+        job.done.wait()
+        if job.music is not None:
+            start = time.perf_counter()
+            try:
+                job.decoded = audio.decode_song(job.music)
+                job.timings["audio_ms"] = (time.perf_counter() - start) * 1000
+            except pygame.error:
+                pass  # Streamed from the compressed file instead
+        job.decode_done.set()
+
+    def start_decoding(self):
+        # Main thread, once the mixer is initialized: decode the last song requested
+        self.decode_audio = True
+        if self.jobs:
+            job = next(reversed(self.jobs.values()))
+            self.preload(job.phase, job.song)
+
+    def release_audio(self, keep):
+        # Decoded songs are large; keep only the one requested last
+        for job in self.jobs.values():
+            if job is not keep and job.decode_done.is_set():
+                job.decoded = None
+                job.decode_started = False
+                job.decode_done.clear()
+
+    def finish(self, job):
+        # Main thread: hand the decoded layers to the asset cache and report how long it took
+        if not job.converted:
+            start = time.perf_counter()
+            for path, surface in job.surfaces.items():
+                job.surfaces[path] = assets.insert(path, surface, (WIDTH, HEIGHT))
+            job.converted = True
+            job.timings["convert_ms"] = (time.perf_counter() - start) * 1000
+        else:
+            # Put back any surface the cache evicted since the last time
+            for path, surface in job.surfaces.items():
+                assets.insert(path, surface, (WIDTH, HEIGHT))
+        return job
 
 # Game Class to Handle Menu, Play, and Pause
 class Game:
     def __init__(self):
         self.state = "menu"
-        self.notes = []
+        self.notes = NoteStore(len(lanes))
         self.paused = False
         self.selected_option = 0
         self.song_selected = 0
         self.music_start_time = 0  # Track when the music started
+        self.cryer = None  # Built when the first game starts
+        self.use_audio_clock = True  # Follow the song's playback position; off for headless runs
+        self.timing = TimingStats()
         self.difficulty = 1  # Default to "easy"
         self.base_note_cooldown = 1000  # Base cooldown in milliseconds
         self.note_cooldown = self.base_note_cooldown // self.difficulty  # Adjusted cooldown
         self.last_note_spawn_time = 0  # Initialize last note spawn time
+        self.play_time = 0  # Game time in ms, only advances while playing and not paused
+        self.chart = None  # [(time_ms, lane), ...] for the current song, None to spawn random notes
+        self.chart_index = 0  # Next chart note to spawn
+        self.rng = random.Random()  # Reseeded for every session so it can be replayed
+        self.session_steps = 0  # Simulation steps played in the current session
+        self.record_folder = None  # Save a recording of each session here when set
+        self.recording = None  # Recording of the session being played
+        self.playback = None  # Recording being replayed, drives the audio clock corrections
 
         self.menu_background = self.background_selection(-1)
 
-    def start_game(self):
+        # Start decoding the highlighted song's phase right away
+        self.loader = PhaseLoader()
+        self.loading_job = None
+        self.loading_started = 0
+        self.music_file = None  # In-memory song handed to the mixer
+        self.calibration_taps = []  # Offsets (ms) of the taps from the nearest click
+        self.stress_notes = None  # Keep this many random notes on screen instead of following the chart
+        self.preload_at = None  # When to load the phase of the highlighted song
+        if library:
+            self.preload_selected()
+
+        # Build the hit/miss dissipation strips up front so gameplay never allocates them
+        for color in (WHITE, GREEN, ORANGE, RED):
+            dissipate_frames(color)
+
+    def start_game(self, wait=False, playback=None):
         global current_song
-        current_song = songs[self.song_selected]
-        current_phase = self.song_selected 
-        self.background_layers = self.background_selection(current_phase)
+        self.playback = playback
+        if playback is not None:
+            self.song_selected = library.find(playback.song)
+            if self.song_selected is None:
+                raise SystemExit(f"{playback.song} is not in the song library")
+            self.difficulty = playback.difficulty
+            self.note_cooldown = self.base_note_cooldown // self.difficulty
+            self.stress_notes = playback.stress_notes or None
+        current_song = library[self.song_selected]
+        current_phase = song_phase(self.song_selected)
+        self.preload_at = None
+        self.loading_job = self.loader.preload(current_phase, current_song)
+        self.loading_started = time.perf_counter()
+        if wait:
+            self.loading_job.wait()
+        if self.loading_job.ready():
+            self.begin_play()
+        else:
+            self.state = "loading"  # Show the progress screen until the loader is done
+
+    def begin_play(self):
+        job = self.loader.finish(self.loading_job)
+        job.timings["wait_ms"] = (time.perf_counter() - self.loading_started) * 1000
+        print(f"Phase {job.phase} load times (ms): " + ", ".join(f"{name} {ms:.0f}" for name, ms in job.timings.items()), file=sys.stderr)
+        self.background_layers = self.background_selection(job.phase)
+        if self.cryer is None:
+            self.cryer = BigCryer()
         self.state = "playing"
         self.notes.clear()
-        global score, combo, combo_streak
+        self.play_time = 0
+        self.timing = TimingStats()
+        self.last_note_spawn_time = -self.note_cooldown  # First note spawns right away
+        self.chart = charts.load_chart(current_song, self.difficulty, job.digest)
+        self.chart_index = 0
+        if self.stress_notes:
+            self.chart = None
+            self.note_cooldown = note_travel_time / self.stress_notes
+            self.last_note_spawn_time = -self.note_cooldown
+        self.session_steps = 0
+        chart = charts.chart_digest(self.chart)
+        if self.playback is not None:
+            if chart != self.playback.chart:
+                self.state = "menu"
+                raise ValueError(f"recorded against chart {self.playback.chart or 'none'}, "
+                                 f"the current chart is {chart or 'none'}")
+            seed = self.playback.seed
+        else:
+            seed = random.getrandbits(64)
+            if self.record_folder is not None:
+                self.recording = Recording(seed, current_song, self.difficulty, chart, self.stress_notes or 0)
+        self.rng.seed(seed)
+        global score, combo, combo_streak, max_combo
         score = 0
         combo = 0
         combo_streak = 0
-        pygame.mixer.music.load(current_song)
+        max_combo = 0
+        if self.playback is not None:
+            return  # Replays run silent, as fast as they are stepped
+        init_mixer()
+        self.loader.release_audio(job)
+        if job.decode_done.is_set() and job.decoded is not None:
+            self.music_file = io.BytesIO(job.decoded)
+            pygame.mixer.music.load(self.music_file, "wav")
+        elif job.music is not None:
+            self.music_file = io.BytesIO(job.music)
+            pygame.mixer.music.load(self.music_file, os.path.splitext(current_song)[1][1:])
+        else:
+            pygame.mixer.music.load(current_song)
         pygame.mixer.music.play(-1)
-        self.music_start_time = pygame.time.get_ticks()  # Record the start time of the music
+        self.music_start_time = time.perf_counter() * 1000  # Record the start time of the music
 
-    def handle_menu(self):
+    def handle_menu(self, alpha=0):
         screen.fill(BLACK)
 
         # Draw the background
-        for layer in self.menu_background:
-            layer.update(screen)
+        self.menu_background.draw(screen, alpha)
         
         # Title
-        title_text = font_large.render("Skater Pro: Chorão", True, WHITE)
+        title_text = text_cache.render(font_large, "Skater Pro: Chorão", WHITE)
         title_rect = title_text.get_rect(center=(WIDTH // 2, HEIGHT // 4))
         screen.blit(title_text, title_rect)
         
         # Menu Options
         play_text_color = RED if self.selected_option == 0 else WHITE
         quit_text_color = RED if self.selected_option == 1 else WHITE
-        play_text = font_medium.render("Play", True, play_text_color)
-        quit_text = font_medium.render("Quit", True, quit_text_color)
+        play_text = text_cache.render(font_medium, "Play", play_text_color)
+        quit_text = text_cache.render(font_medium, "Quit", quit_text_color)
         
         # Center menu options
-        play_rect = play_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 60))
+        play_rect = play_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - px(60)))
         quit_rect = quit_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
         screen.blit(play_text, play_rect)
         screen.blit(quit_text, quit_rect)
         
-        # Display song list
-        dica = small_font.render("side arrows to change song", True, GREY)
-        dica_rect = dica.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 100))
+        # Display song list, only the rows around the selected song
+        if library:
+            hint = f"side arrows to change song, Page Up/Down to skip ({self.song_selected + 1}/{len(library)})"
+        else:
+            hint = f"no songs found in {library.folder}"
+        dica = text_cache.render(small_font, hint, GREY)
+        dica_rect = dica.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(100)))
         screen.blit(dica, dica_rect)
-        for i, song in enumerate(songs):
+        first = max(0, min(self.song_selected - MENU_SONG_ROWS // 2, len(library) - MENU_SONG_ROWS))
+        for row, i in enumerate(range(first, min(first + MENU_SONG_ROWS, len(library)))):
             song_text_color = RED if self.song_selected == i else GREY
-            song_text = font_medium.render(f"{song} (High Score: {high_scores[song]})", True, song_text_color)
-            song_rect = song_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 140 + (i * 50)))
+            song_text = text_cache.render(font_medium, self.song_label(library[i]), song_text_color)
+            song_rect = song_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(140 + row * 50)))
             screen.blit(song_text, song_rect)
 
         # Display difficulty selection
-        difficulty_text = small_font.render(f"Difficulty: {self.difficulty} (Press 1 Easy, 2 Medium, 3 Hard, 4 Extreme, 5 Cryer)", True, GREY)
-        difficulty_rect = difficulty_text.get_rect(center=(WIDTH // 2, HEIGHT - 50))
+        difficulty_text = text_cache.render(small_font, f"Difficulty: {self.difficulty} (Press 1 Easy, 2 Medium, 3 Hard, 4 Extreme, 5 Cryer)", GREY)
+        difficulty_rect = difficulty_text.get_rect(center=(WIDTH // 2, HEIGHT - px(50)))
         screen.blit(difficulty_text, difficulty_rect)
+        calibrate_text = text_cache.render(small_font, f"Audio offset: {settings['audio_offset_ms']:+d} ms (Press C to calibrate)", GREY)
+        screen.blit(calibrate_text, calibrate_text.get_rect(center=(WIDTH // 2, HEIGHT - px(25))))
             
+    def song_label(self, song):
+        info = library.info(song)
+        label = os.path.basename(song)
+        if info["duration"] is not None:
+            label += f" {info['duration'] // 60000}:{info['duration'] // 1000 % 60:02d}"
+        label += f" (High Score: {score_book.best(song, self.difficulty)})"
+        if self.difficulty not in info["charts"]:
+            label += " - no chart"
+        return label
+
+    def select_song(self, index):
+        # Move the selection, the phase is loaded once it rests there
+        self.song_selected = index % len(library)
+        self.preload_at = time.perf_counter() + PRELOAD_DELAY
+
+    def preload_selected(self):
+        self.loader.preload(song_phase(self.song_selected), library[self.song_selected])
+
     def pause_game(self):
         self.paused = True
-        for bg_layer in self.background_layers:
-            bg_layer.speed = 0
-        pygame.mixer.music.pause()
+        self.background_layers.pause()
+        if pygame.mixer.get_init():
+            pygame.mixer.music.pause()
 
     def resume_game(self):
         self.paused = False
-        speed = 1
-        for bg_layer in self.background_layers:
-            bg_layer.speed = speed
-            speed += 1
-        pygame.mixer.music.unpause()
+        self.background_layers.resume()
+        if pygame.mixer.get_init():
+            pygame.mixer.music.unpause()
 
     def back_to_menu(self):
         self.state = "menu"
-        pygame.mixer.music.stop()
+        if pygame.mixer.get_init():
+            pygame.mixer.music.stop()
+        self.end_session()
+
+    def end_session(self):
+        # Save the session's recording, if one was being made
+        if self.recording is not None:
+            self.recording.end(self.session_steps)
+            song = os.path.splitext(self.recording.song)[0]
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{song}-d{self.recording.difficulty}.rpl"
+            os.makedirs(self.record_folder, exist_ok=True)
+            self.recording.save(os.path.join(self.record_folder, name))
+            self.recording = None
+
+    def start_calibration(self):
+        init_mixer()
+        self.calibration_taps = []
+        self.music_file = io.BytesIO(audio.click_track(CALIBRATION_BEAT_MS, CALIBRATION_BEATS))
+        pygame.mixer.music.load(self.music_file, "wav")
+        pygame.mixer.music.play()
+        self.state = "calibrate"
+
+    def calibration_tap(self):
+        # Distance from the nearest click on the raw audio clock, without the current offset
+        position = pygame.mixer.music.get_pos()
+        beat = round(position / CALIBRATION_BEAT_MS)
+        offset = position - beat * CALIBRATION_BEAT_MS
+        if 1 <= beat <= CALIBRATION_BEATS and abs(offset) <= CALIBRATION_MAX_OFFSET:
+            self.calibration_taps.append(offset)
+
+    def finish_calibration(self):
+        if len(self.calibration_taps) >= CALIBRATION_MIN_TAPS:
+            settings["audio_offset_ms"] = round(audio.median(self.calibration_taps))
+            save_settings(settings)
+        self.back_to_menu()
+
+    def handle_calibration(self):
+        screen.fill(BLACK)
+        title_text = text_cache.render(font_medium, "Audio calibration", WHITE)
+        screen.blit(title_text, title_text.get_rect(center=(WIDTH // 2, HEIGHT // 4)))
+        help_text = text_cache.render(small_font, "Press SPACE on every click you hear", GREY)
+        screen.blit(help_text, help_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - px(60))))
+        taps = len(self.calibration_taps)
+        if taps:
+            result = f"{taps} taps, offset {audio.median(self.calibration_taps):+.0f} ms"
+        else:
+            result = f"Current offset {settings['audio_offset_ms']:+d} ms"
+        result_text = text_cache.render(font_medium, result, WHITE)
+        screen.blit(result_text, result_text.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
+        if taps >= CALIBRATION_MIN_TAPS:
+            footer = "Press Enter to save, ESC to cancel"
+        else:
+            footer = f"Tap at least {CALIBRATION_MIN_TAPS} times, ESC to cancel"
+        footer_text = text_cache.render(small_font, footer, GREY)
+        screen.blit(footer_text, footer_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(80))))
 
     def handle_game_over(self):
         screen.fill(BLACK)
-        game_over_text = font_large.render("Game Over", True, WHITE)
-        score_text = font_medium.render(f"Score: {score}", True, WHITE)
-        high_score_text = font_medium.render(f"High Score: {high_scores[current_song]}", True, WHITE)
-        return_text = font_medium.render("Press Enter to return to Menu", True, GREY)
+        game_over_text = text_cache.render(font_large, "Game Over", WHITE)
+        score_text = text_cache.render(font_medium, f"Score: {score}", WHITE)
+        high_score_text = text_cache.render(font_medium, f"High Score: {score_book.best(current_song, self.difficulty)}", WHITE)
+        return_text = text_cache.render(font_medium, "Press Enter to return to Menu", GREY)
         
         # Center the game over text
         screen.blit(game_over_text, game_over_text.get_rect(center=(WIDTH // 2, HEIGHT // 4)))
         screen.blit(score_text, score_text.get_rect(center=(WIDTH // 2, HEIGHT // 2)))
-        screen.blit(high_score_text, high_score_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 50)))
-        screen.blit(return_text, return_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 100)))
+        screen.blit(high_score_text, high_score_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(50))))
+        screen.blit(return_text, return_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(100))))
+        timing_text = text_cache.render(small_font, self.timing.summary(), GREY)
+        screen.blit(timing_text, timing_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + px(160))))
         
+    def handle_loading(self, alpha=0):
+        screen.fill(BLACK)
+        self.menu_background.draw(screen, alpha)
+
+        loading_text = text_cache.render(font_medium, "Loading...", WHITE)
+        screen.blit(loading_text, loading_text.get_rect(center=(WIDTH // 2, HEIGHT // 2 - px(40))))
+
+        # Progress bar
+        bar = pygame.Rect(0, 0, WIDTH // 3, px(20))
+        bar.center = (WIDTH // 2, HEIGHT // 2 + px(20))
+        pygame.draw.rect(screen, GREY, bar, max(1, px(2)))
+        filled = bar.inflate(-px(6), -px(6))
+        filled.width = int(filled.width * self.loading_job.progress())
+        pygame.draw.rect(screen, WHITE, filled)
+
     def handle_pause(self):
-        for layer in self.background_layers:
-            layer.update(screen)
+        self.background_layers.draw(screen)
         text_color = WHITE
         outline_color = BLACK
-        draw_text_with_outline("Paused", font, text_color, outline_color, WIDTH // 2 - 20, HEIGHT // 4 - 50)
-        draw_text_with_outline("Press ESC to Resume", font, text_color, outline_color, WIDTH // 2 - 100, HEIGHT // 2 - 50)
-        draw_text_with_outline("Press M to Return to Menu", font, text_color, outline_color, WIDTH // 2 - 150, HEIGHT // 2)
+        draw_text_with_outline("Paused", font, text_color, outline_color, WIDTH // 2 - px(20), HEIGHT // 4 - px(50))
+        draw_text_with_outline("Press ESC to Resume", font, text_color, outline_color, WIDTH // 2 - px(100), HEIGHT // 2 - px(50))
+        draw_text_with_outline("Press M to Return to Menu", font, text_color, outline_color, WIDTH // 2 - px(150), HEIGHT // 2)
         
 
-    def handle_play(self):
+    def song_time(self):
+        # Position in the song (ms) the player hears, from the audio clock, or game time without one.
+        # The calibrated offset moves the notes and the judging to when the music reaches the player.
+        if self.use_audio_clock and pygame.mixer.get_init():
+            position = pygame.mixer.music.get_pos()
+            if position >= 0:
+                return position - settings["audio_offset_ms"]
+        return self.play_time
+
+    def step_play(self):
+        # One fixed simulation step of gameplay
+        self.session_steps += 1
+        self.play_time += TICK_MS
+
+        # Keep game time locked to the music. Corrections are recorded, so a
+        # replay follows the same game time without the audio clock.
+        if self.playback is not None:
+            correction = self.playback.correction(self.session_steps)
+        else:
+            drift = self.song_time() - self.play_time
+            if abs(drift) > AUDIO_RESYNC_MS:
+                correction = drift
+            elif abs(drift) > AUDIO_DEADBAND_MS:
+                correction = drift * AUDIO_SLEW
+            else:
+                correction = 0.0
+            if correction and self.recording is not None:
+                self.recording.clock(self.session_steps, correction)
+        self.play_time += correction
+
         # Check if the music has reached the max time
-        elapsed_time = pygame.time.get_ticks() - self.music_start_time
-        if elapsed_time >= MUSIC_MAX_TIME:
-            pygame.mixer.music.stop()
-            if score > high_scores[current_song]:  # Update high score if beaten
-                high_scores[current_song] = score
-                save_high_scores()  # Save high scores to file
+        if self.play_time >= MUSIC_MAX_TIME:
+            if pygame.mixer.get_init():
+                pygame.mixer.music.stop()
+            self.record_run(completed=True)  # Saved in the background, the game over screen never waits
             self.state = "game_over"  # Switch to game over state
+            self.end_session()
+            return
+
+        if self.chart is not None:
+            # Stream notes from the song's chart so they reach the striking zone on the beat
+            while self.chart_index < len(self.chart):
+                time_ms, key = self.chart[self.chart_index]
+                spawn_time = time_ms - note_travel_time
+                if spawn_time > self.play_time:
+                    break
+                self.chart_index += 1
+                if spawn_time >= 0:  # Skip notes too early in the song to fall the whole lane
+                    self.notes.spawn(lanes[key], key, spawn_time)
+        else:
+            # No chart for this song: spawn notes on their exact schedule, even if several are due in one step
+            while self.play_time - self.last_note_spawn_time >= self.note_cooldown:
+                # Pick one random lane to spawn a note in
+                lane = self.rng.choice(lanes)
+                key = lanes.index(lane)
+                self.last_note_spawn_time += self.note_cooldown
+                self.notes.spawn(lane, key, self.last_note_spawn_time)
+
+        self.background_layers.step()
+
+        # Advance the judged notes' dissipation
+        finished = 0
+        for note in self.notes.judged:
+            if note.dissipate():
+                finished += 1
+        self.notes.release_finished(finished)
+
+        # Move the falling notes
+        for queue in self.notes.lanes:
+            for note in queue:
+                note.fall(self.play_time)
+
+        # Check for notes that are missed (only the oldest note of each lane can be late)
+        for queue in self.notes.lanes:
+            while queue and self.play_time - queue[0].target_time() > judge_windows["miss"]:
+                note = queue[0]
+                self.notes.judge(note)
+                calculate_score(note, accuracy="miss")
+                self.timing.add("miss")
 
-        # Check if enough time has passed to spawn a new note
-        current_time = pygame.time.get_ticks()
-        if current_time - self.last_note_spawn_time >= self.note_cooldown:
-            # Pick one random lane to spawn a note in
-            lane = random.choice(lanes)
-            key = lanes.index(lane)
-            self.notes.append(Note(lane, key))
-            self.last_note_spawn_time = current_time  # Update the last spawn time
+    def handle_play(self, alpha=0):
+        # Render time between the last simulation step and the next one
+        render_time = self.play_time + alpha * TICK_MS
 
         # Draw backgrounds
-        for layer in self.background_layers:
-            layer.update(screen)
-
-        # Draw the striking zone
-        for i, lane in enumerate(lanes):
-            pygame.draw.line(screen, WHITE, (lane + 25, 0), (lane + 25, HEIGHT), 2)
-
-        # Draw the notes and handle dissipation
-        for note in self.notes[:]:
-            if note.dissipating:
-                if note.dissipate():
-                    self.notes.remove(note)
-            else:
-                note.fall()
-            note.draw(screen)
-
-        # Check for notes that are missed
-        for note in self.notes[:]:
-            if note.rect.y > striking_zone_y + 50 and not note.hit:
-                note.hit = True
-                calculate_score(note, accuracy="miss")
-
-    def update(self):
+        self.background_layers.draw(screen, alpha)
+
+        # Draw the lane lines, the judged notes, then the falling ones
+        self.draw_notes(render_time)
+
+    def draw_notes(self, render_time):
+        # Everything over the lanes in one Surface.blits call. Positions are
+        # worked out here rather than per note in Note.draw, and notes outside
+        # the screen are left out of the batch.
+        batch = list(lane_batches()[0])
+        for note in self.notes.judged:
+            if note.dissipate_step == 0:
+                batch.append((note.current_arrow, note.rect.topleft))
+            elif note.dissipate_step < DISSIPATE_STEPS:
+                frame = dissipate_frames(note.dissipate_color)[note.dissipate_step]
+                radius = frame.get_width() // 2
+                batch.append((frame, (note.rect.centerx - radius, note.rect.centery - radius)))
+        top = -arrow_size[1]
+        for queue in self.notes.lanes:
+            if not queue:
+                continue
+            # Every note of a lane has the same sprite and x. Oldest note first,
+            # so each note is above the previous one: below the screen or on
+            # the same row as the note just drawn means it is skipped.
+            arrow = queue[0].current_arrow
+            x = queue[0].rect.x
+            last_y = HEIGHT
+            for note in queue:
+                y = int(note_start_y + (render_time - note.spawn_time) * note_speed_ms)
+                if y <= top:
+                    break
+                if y < last_y:
+                    batch.append((arrow, (x, y)))
+                    last_y = y
+        screen.blits(batch, doreturn=False)
+
+    def step(self):
+        if self.state == "menu":
+            self.menu_background.step()
+            if self.preload_at is not None and time.perf_counter() >= self.preload_at:
+                self.preload_at = None
+                self.preload_selected()
+        elif self.state == "loading":
+            self.menu_background.step()
+            if self.loading_job.ready():
+                self.begin_play()
+        elif self.state == "playing" and not self.paused:
+            self.step_play()
+
+    def update(self, alpha=0):
         if self.state == "menu":
-            self.handle_menu()
+            self.handle_menu(alpha)
+        elif self.state == "loading":
+            self.handle_loading(alpha)
         elif self.state == "playing":
             if not self.paused:
-                self.handle_play()
+                self.handle_play(alpha)
             else:
                 self.handle_pause()
         elif self.state == "game_over":
             self.handle_game_over()
-
-    def handle_input(self, event):
+        elif self.state == "calibrate":
+            self.handle_calibration()
+
+    def record_run(self, completed):
+        if self.playback is not None or self.stress_notes:
+            return  # Replayed runs and stress tests are not new scores
+        score_book.record(current_song, self.difficulty, score, max_combo, self.timing.counts, completed)
+
+    def judge_press(self, lane_index, press_time):
+        # Judge a key press at press_time (song ms) against the lane's next note
+        current_note = self.notes.next_in_lane(lane_index)
+        if current_note is None:
+            return
+        offset = press_time - current_note.target_time()
+        grade = judge_offset(offset)
+        if grade is not None:
+            self.notes.judge(current_note)
+            calculate_score(current_note, accuracy=grade)
+            self.timing.add(grade, offset)
+
+    def handle_input(self, event, input_time=None):
+        # input_time: song time the event's batch was read at, see main()
         if self.state == "menu":
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RETURN:  # Select option
-                    if self.selected_option == 0:  # Start Game
+                    if self.selected_option == 0 and library:  # Start Game
                         self.start_game()
                     elif self.selected_option == 1:  # Quit Game
-                        pygame.quit()
-                        exit()
+                        # main() shuts down like the window was closed: scores, trace, stats
+                        pygame.event.post(pygame.event.Event(pygame.QUIT))
                 elif event.key == pygame.K_UP:
                     self.selected_option = (self.selected_option - 1) % 2
                 elif event.key == pygame.K_DOWN:
                     self.selected_option = (self.selected_option + 1) % 2
-                elif event.key == pygame.K_LEFT:
-                    self.song_selected = (self.song_selected - 1) % len(songs)
-                elif event.key == pygame.K_RIGHT:
-                    self.song_selected = (self.song_selected + 1) % len(songs)
+                elif event.key == pygame.K_LEFT and library:
+                    self.select_song(self.song_selected - 1)
+                elif event.key == pygame.K_RIGHT and library:
+                    self.select_song(self.song_selected + 1)
+                elif event.key == pygame.K_PAGEUP and library:
+                    self.select_song(max(0, self.song_selected - MENU_PAGE))
+                elif event.key == pygame.K_PAGEDOWN and library:
+                    self.select_song(min(len(library) - 1, self.song_selected + MENU_PAGE))
                     
                 # Difficulty selection
                 elif event.key == pygame.K_1:
@@ -433,19 +1215,30 @@ class Game:
                 elif event.key == pygame.K_5:
                     self.difficulty = 5
                     self.note_cooldown = self.base_note_cooldown // self.difficulty
+                elif event.key == pygame.K_c:
+                    self.start_calibration()
 
 
 
+        elif self.state == "loading":
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                self.state = "menu"  # The phase keeps loading in the background
+
         elif self.state == "playing":
             if event.type == pygame.KEYDOWN:
+                # Replayed presses carry the song time they were recorded at
+                press_time = getattr(event, "press_time", input_time)
+                if press_time is None:
+                    press_time = self.song_time()
+                if self.recording is not None:
+                    self.recording.key_down(self.session_steps, event.key, press_time)
                 if event.key == pygame.K_ESCAPE:
                     if not self.paused:
                         self.pause_game()
                     else:
                         self.resume_game()
                 if self.paused and event.key == pygame.K_m:
-                    if score > high_scores[current_song]:  # Save the high score if beaten
-                        high_scores[current_song] = score
+                    self.record_run(completed=False)  # Keep the run, and the high score if beaten
                     self.paused = False
                     self.back_to_menu()
 
@@ -453,114 +1246,250 @@ class Game:
                 if not self.paused:
                     for lane_index, lane_key in enumerate([pygame.K_LEFT, pygame.K_DOWN, pygame.K_UP, pygame.K_RIGHT]):
                         if event.key == lane_key:
-                            current_note = find_next_note_in_lane(lane_index, self.notes)
-                            if current_note and current_note.rect.y < striking_zone_y - 50 and not current_note.hit:
-                                current_note.hit = True
-                                calculate_score(current_note, accuracy="early")
-                            elif current_note and HEIGHT - striking_zone_height - 50 < current_note.rect.y < HEIGHT - striking_zone_height + 50 and not current_note.hit:
-                                current_note.hit = True
-                                calculate_score(current_note, accuracy="good")
+                            self.judge_press(lane_index, press_time)
 
         elif self.state == "game_over" and event.type == pygame.KEYDOWN:
             if event.key == pygame.K_RETURN:
                 self.back_to_menu()
 
+        elif self.state == "calibrate" and event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_SPACE:
+                self.calibration_tap()
+            elif event.key == pygame.K_RETURN:
+                self.finish_calibration()
+            elif event.key == pygame.K_ESCAPE:
+                self.back_to_menu()
+
     def background_selection(self, background_selected):
-        if background_selected == 0:
-            background_layers = [
-                BackgroundLayer("Sprites/bg/fase1/Sky.png", 1),
-                BackgroundLayer("Sprites/bg/fase1/back.png", 2),
-                BackgroundLayer("Sprites/bg/fase1/houses3.png", 3),
-                BackgroundLayer("Sprites/bg/fase1/houses1.png", 4),
-                BackgroundLayer("Sprites/bg/fase1/minishop&callbox.png", 5),
-                BackgroundLayer("Sprites/bg/fase1/road&lamps.png", 6)
-            ]
-        elif background_selected == 1:
-            background_layers = [
-                BackgroundLayer("Sprites/bg/fase2/1.png", 1),
-                BackgroundLayer("Sprites/bg/fase2/2.png", 2),
-                BackgroundLayer("Sprites/bg/fase2/3.png", 3),
-                BackgroundLayer("Sprites/bg/fase2/4.png", 4),
-                BackgroundLayer("Sprites/bg/fase2/5.png", 5),
-                BackgroundLayer("Sprites/bg/fase2/7.png", 6),
-                BackgroundLayer("Sprites/bg/fase2/road2.png", 7)
-            ]
-        elif background_selected == 2:
-            background_layers = [
-                BackgroundLayer("Sprites/bg/fase3/Sky.png", 1),
-                BackgroundLayer("Sprites/bg/fase3/houses.png", 2),
-                BackgroundLayer("Sprites/bg/fase3/houses2.png", 3),
-                BackgroundLayer("Sprites/bg/fase3/fountain&bush.png", 4),
-                BackgroundLayer("Sprites/bg/fase3/houses1.png", 5),
-                BackgroundLayer("Sprites/bg/fase3/umbrella&policebox.png", 6),
-                BackgroundLayer("Sprites/bg/fase3/road.png", 7)
-            ]
-        elif background_selected == -1:
-            background_layers = [
-                BackgroundLayer("Sprites/bg/menu/Sky.png", 1),
-                BackgroundLayer("Sprites/bg/menu/buildings.png", 2),
-                BackgroundLayer("Sprites/bg/menu/wall2.png", 3),
-                BackgroundLayer("Sprites/bg/menu/wall1.png", 4),
-                BackgroundLayer("Sprites/bg/menu/boxes&container.png", 5),
-                BackgroundLayer("Sprites/bg/menu/wheels&hydrant.png", 6),
-                BackgroundLayer("Sprites/bg/menu/road&border.png", 7),
-            ]
-        return background_layers
+        speed = 1
+        background_layers = []
+        for path in phase_layers[background_selected]:
+            background_layers.append(BackgroundLayer(path, speed))
+            speed += 1
+        return ParallaxBackground(background_layers)
 
 def draw_text_with_outline(text, font, color, outline_color, x, y):
-    outline_text = font.render(text, True, outline_color)
-    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1), (-1, 1), (1, -1)]:
-        screen.blit(outline_text, (x + dx, y + dy))
-
-    main_text = font.render(text, True, color)
-    screen.blit(main_text, (x, y))
-
-# Initialize game instance
-game = Game()
-
-# Initialize Character BigCryer
-cryer = BigCryer()
-
-# Game loop
-clock = pygame.time.Clock()
-running = True
-while running:
-    screen.fill(BLACK)
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_DOWN:
-                cryer.set_animation("crouch")
-            elif event.key == pygame.K_UP:
-                cryer.set_animation("jump")
-            elif event.key == pygame.K_RIGHT:
-                cryer.set_animation("trick1")
-            elif event.key == pygame.K_LEFT:
-                cryer.set_animation("trick2")
-            elif event.key == pygame.K_RETURN:
-                cryer.set_animation("start_walk")
-
-        # Handle input in the game
-        game.handle_input(event)
-    
-    
-    # Update the game based on state
-    game.update()
+    # The cached label has a 1px outline border around the text
+    label = text_cache.render(font, text, color, outline_color)
+    screen.blit(label, (x - 1, y - 1))
+
+# Draw the fixed arrows, the score and the combo in one batch
+def draw_hud():
+    batch = list(lane_batches()[1])
+    batch.append((text_cache.render(font, f"Score: {score}", WHITE), (px(10), px(10))))
+    batch.append((text_cache.render(font, f"Combo: {combo}", WHITE), (px(10), px(60))))
+    screen.blits(batch, doreturn=False)
+
+# Nothing on screen changes on its own: the last frame can stay up while the
+# loop sleeps. Loading always runs, it has to notice when the phase is ready.
+def is_idle(game, focused, idle_seconds):
+    if game.state == "loading":
+        return False
     if game.state == "playing":
-        cryer.update(screen)
-    
-
-    # Draw the score and combo on the screen if the game is playing
-    if game.state == "playing" and not game.paused:
-        score_label = font.render(f"Score: {score}", True, WHITE)
-        combo_label = font.render(f"Combo: {combo}", True, WHITE)
-        screen.blit(score_label, (10, 10))
-        screen.blit(combo_label, (10, 60))
-        draw_fixed_arrows()
-
-    pygame.display.flip()
-    clock.tick(60)
+        return game.paused  # A running song is never idle, main() pauses it when focus goes
+    if not focused:
+        return True
+    if game.state == "menu":
+        return idle_seconds >= MENU_IDLE_SECONDS
+    return True  # Game over and calibration only change on input
+
+# Profiler stage names for Game.update in each state
+update_stages = {
+    "menu": "update:menu",
+    "loading": "update:loading",
+    "playing": "update:play",
+    "game_over": "update:game_over",
+    "calibrate": "update:calibrate",
+}
+
+def update_stage(game):
+    if game.state == "playing" and game.paused:
+        return "update:pause"
+    return update_stages[game.state]
+
+def run_replay(game, recording, realtime=False):
+    # Feed a recording back through Game.handle_input step by step. Without
+    # realtime nothing is drawn and the steps run as fast as they can.
+    game.use_audio_clock = False
+    game.start_game(wait=True, playback=recording)
+    clock = pygame.time.Clock()
+    while game.state == "playing" and not recording.finished(game.session_steps):
+        for key, press_time in recording.keys_until(game.session_steps):
+            game.handle_input(pygame.event.Event(pygame.KEYDOWN, key=key, press_time=press_time))
+        if game.state != "playing":
+            break
+        if game.paused:
+            # Steps don't advance while paused, so only input on this step could resume it
+            if recording.finished(game.session_steps):
+                break
+            raise ValueError(f"paused at step {game.session_steps} with no input left to resume it")
+        game.step()
+        if realtime:
+            clock.tick(TICK_RATE)
+            pygame.event.pump()
+            game.update()
+            game.cryer.draw(screen, game.play_time)
+            if not game.paused:
+                draw_hud()
+            present()
+            pygame.display.flip()
+    return score, max_combo
+
+def main():
+    parser = argparse.ArgumentParser(description="Pro Skater: Chorão Edition")
+    parser.add_argument("--profile", action="store_true", help="start with the profiler overlay on (toggle with F3)")
+    parser.add_argument("--trace", metavar="FILE", help="record a Chrome trace of every frame and write it to FILE on exit")
+    parser.add_argument("--record", metavar="FOLDER", help="save a replay of every session into FOLDER")
+    parser.add_argument("--replay", metavar="FILE", help="replay a recorded session and print its score")
+    parser.add_argument("--realtime", action="store_true", help="show the replay at normal speed instead of running it headless")
+    parser.add_argument("--render-size", type=parse_size, metavar="WxH", help="internal resolution, e.g. 640x360 (default from settings.json)")
+    parser.add_argument("--stress", type=int, metavar="NOTES", help="stress test: keep this many notes on screen")
+    parser.add_argument("--pacing", choices=PACING_MODES, help="how frames are paced (default from settings.json)")
+    parser.add_argument("--fps", type=int, help="target frame rate, 0 for none (default from settings.json)")
+    args = parser.parse_args()
+    if args.render_size:
+        set_render_size(*args.render_size)
+    # Command line overrides stay out of settings, which the calibration saves
+    pacing = args.pacing or settings["frame_pacing"]
+    frame_rate = settings["frame_rate"] if args.fps is None else args.fps
+    if args.profile:
+        profiler.toggle_overlay()
+    if args.trace:
+        profiler.start_trace(args.trace)
+    if args.replay and not args.realtime:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+    if not init(vsync=pacing == "vsync") and pacing == "vsync":
+        print("No vsync on this display, pacing frames with hybrid instead", file=sys.stderr)
+        pacing = "hybrid"
+
+    # Initialize game instance
+    game = Game()
+    if args.replay:
+        start = time.perf_counter()
+        try:
+            recording = Recording.load(args.replay)
+            final_score, final_combo = run_replay(game, recording, args.realtime)
+        except ValueError as error:
+            score_book.close()
+            parser.exit(1, f"{args.replay}: {error}\n")
+        print(f"{args.replay}: score {final_score}, max combo {final_combo}, {game.timing.summary()} "
+              f"({recording.end_step} steps in {time.perf_counter() - start:.2f}s)")
+        score_book.close()
+        pygame.quit()
+        return
+    game.record_folder = args.record
+    game.stress_notes = args.stress
+    mark_startup("menu")
+    first_frame = True
+
+    # Game loop
+    pacer = FramePacer(pacing, frame_rate)
+    accumulator = 0  # Elapsed ms not yet consumed by simulation steps
+    running = True
+    idle = False
+    focused = True
+    last_input = time.perf_counter()
+    while running:
+        if idle:
+            # Keep the last frame on screen and sleep until an event arrives or the wait times out
+            event = pygame.event.wait(IDLE_WAIT_MS)
+            events = [] if event.type == pygame.NOEVENT else [event] + pygame.event.get()
+            pacer.reset()  # The time spent waiting is not simulated or counted as a frame
+        else:
+            accumulator += min(pacer.tick(), MAX_FRAME_MS)
+            events = pygame.event.get()
+        # pygame 2.6 events carry no timestamp, so every press in a batch gets the song time
+        # read right after the batch was fetched. A press is judged up to one frame late
+        # (16.7 ms at 60 FPS, less with a higher frame rate), never early.
+        input_time = game.song_time() if game.state == "playing" else None
+        frame_time = time.perf_counter() * 1000  # Drives the character animation
+
+        for event in events:
+            if event.type in (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN):
+                last_input = time.perf_counter()
+            elif event.type == pygame.WINDOWFOCUSLOST:
+                focused = False
+            elif event.type == pygame.WINDOWFOCUSGAINED:
+                focused = True
+        was_idle = idle
+        idle = is_idle(game, focused, time.perf_counter() - last_input)
+        if idle and was_idle and not events:
+            continue
+        if was_idle:
+            profiler.skip_frame()  # The wait is not a frame
+        profiler.begin_frame()
+        screen.fill(BLACK)
 
-pygame.quit()
\ No newline at end of file
+        with profiler.stage("events"):
+            for event in events:
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.VIDEORESIZE:
+                    resize_window()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    profiler.toggle_overlay()
+                    continue
+                elif event.type == pygame.KEYDOWN and game.cryer is not None:
+                    if event.key == pygame.K_DOWN:
+                        game.cryer.set_animation("crouch", frame_time)
+                    elif event.key == pygame.K_UP:
+                        game.cryer.set_animation("jump", frame_time)
+                    elif event.key == pygame.K_RIGHT:
+                        game.cryer.set_animation("trick1", frame_time)
+                    elif event.key == pygame.K_LEFT:
+                        game.cryer.set_animation("trick2", frame_time)
+                    elif event.key == pygame.K_RETURN:
+                        game.cryer.set_animation("start_walk", frame_time)
+
+                # Handle input in the game
+                game.handle_input(event, input_time)
+
+        # Run as many fixed simulation steps as the elapsed time asks for
+        while accumulator >= TICK_MS:
+            with profiler.stage("step"):
+                game.step()
+            accumulator -= TICK_MS
+
+        # A song doesn't play on in an unfocused window, whether focus was lost mid-song or
+        # the phase finished loading without it. The pause goes through handle_input like
+        # the player's ESC, so it is recorded and a replay pauses and resumes the same way.
+        if not focused and game.state == "playing" and not game.paused:
+            game.handle_input(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_ESCAPE))
+
+        # Draw the game based on state, interpolated between simulation steps
+        with profiler.stage(update_stage(game)):
+            game.update(accumulator / TICK_MS)
+        if game.state == "playing":
+            with profiler.stage("cryer"):
+                game.cryer.draw(screen, frame_time)
+
+        # Draw the score and combo on the screen if the game is playing
+        if game.state == "playing" and not game.paused:
+            with profiler.stage("hud"):
+                draw_hud()
+
+        with profiler.stage("present"):
+            present()
+        profiler.draw(window, text_cache, pacer.summary)
+        with profiler.stage("flip"):
+            pygame.display.flip()
+        # Input can end an idle state (or start one), look again before the next frame
+        idle = idle and is_idle(game, focused, time.perf_counter() - last_input)
+        if first_frame:
+            first_frame = False
+            mark_startup("first frame")
+            print(startup_report())
+            # The menu is up: start the mixer and decode songs ahead of playback
+            init_mixer()
+            game.loader.start_decoding()
+
+    game.end_session()  # Keep the recording of a session the window was closed on
+    score_book.close()  # Finish pending score writes
+    profiler.write_trace()
+    if profiler.enabled:
+        print(pacer.stats())
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
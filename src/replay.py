@@ -0,0 +1,78 @@
+import struct
+
+from files import write_atomic
+
+# Session recordings for deterministic replays. A recording holds the session's
+# RNG seed, song, difficulty, stress note count and the digest of the chart it
+# was played against, then one record per input event or audio clock
+# correction, stamped with the simulation step it happened on.
+REPLAY_MAGIC = b"RPLY"
+REPLAY_VERSION = 3
+REPLAY_HEADER = struct.Struct("<4sBQBI12sH")  # magic, version, seed, difficulty, stress notes, chart digest, song name length
+REPLAY_RECORD = struct.Struct("<IBid")  # step, kind, key, value
+
+KEY_DOWN = 0  # value: press time in song ms
+CLOCK = 1  # value: ms added to game time to follow the audio clock
+END = 2  # Session ended on this step
+
+
+class Recording:
+    def __init__(self, seed, song, difficulty, chart="", stress_notes=0):
+        self.seed = seed
+        self.song = song
+        self.difficulty = difficulty
+        self.chart = chart  # charts.chart_digest of the notes played, "" without a chart
+        self.stress_notes = stress_notes  # --stress note count, 0 for a normal session
+        self.records = []  # (step, kind, key, value) in the order they happened
+        self.corrections = {}  # step -> clock correction, for playback
+        self.position = 0  # Next record to play back
+        self.end_step = None  # Last step of the session
+
+    def key_down(self, step, key, press_time):
+        self.records.append((step, KEY_DOWN, key, press_time))
+
+    def clock(self, step, correction):
+        self.records.append((step, CLOCK, 0, correction))
+
+    def end(self, step):
+        self.records.append((step, END, 0, 0.0))
+        self.end_step = step
+
+    def save(self, path):
+        song = self.song.encode()
+        data = bytearray(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.difficulty, self.stress_notes,
+                                                 self.chart.encode(), len(song)))
+        data += song
+        for record in self.records:
+            data += REPLAY_RECORD.pack(*record)
+        write_atomic(path, bytes(data))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, seed, difficulty, stress_notes, chart, song_length = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"{path} is not a version {REPLAY_VERSION} recording")
+        start = REPLAY_HEADER.size + song_length
+        song = data[REPLAY_HEADER.size:start].decode()
+        recording = cls(seed, song, difficulty, chart.rstrip(b"\0").decode(), stress_notes)
+        recording.records = list(REPLAY_RECORD.iter_unpack(data[start:]))
+        recording.corrections = {step: value for step, kind, key, value in recording.records if kind == CLOCK}
+        recording.end_step = max((step for step, kind, key, value in recording.records if kind == END), default=None)
+        return recording
+
+    def keys_until(self, step):
+        # Key presses recorded up to the given step that were not played back yet
+        while self.position < len(self.records) and self.records[self.position][0] <= step:
+            record_step, kind, key, value = self.records[self.position]
+            self.position += 1
+            if kind == KEY_DOWN:
+                yield key, value
+
+    def correction(self, step):
+        return self.corrections.get(step, 0.0)
+
+    def finished(self, step):
+        # True once the session's last step has been played
+        return self.end_step is not None and step >= self.end_step
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import queue
+import threading
+
+from files import write_atomic
+
+# Score history: every run is appended as one JSON line to the run log, and a
+# small index with the best score per song and difficulty is rewritten
+# atomically after each run. The index can always be rebuilt from the log, so
+# a crash while writing loses at most the run being written.
+RUN_LOG = "runs.log"
+SCORE_INDEX = "score_index.json"
+LEGACY_SCORE_FILE = "high_scores.json"  # Per-song bests from before difficulties were tracked
+INDEX_VERSION = 1
+LEGACY_DIFFICULTY = 0  # Difficulty the imported legacy bests are filed under
+
+# Fields of a run log line, in order
+RUN_FIELDS = ["time", "song", "difficulty", "score", "max_combo", "early", "good", "half", "miss", "completed"]
+
+
+def entry_key(song, difficulty):
+    return f"{song}:{difficulty}"
+
+
+class ScoreBook:
+    def __init__(self, folder="."):
+        self.log_path = os.path.join(folder, RUN_LOG)
+        self.index_path = os.path.join(folder, SCORE_INDEX)
+        self.legacy_path = os.path.join(folder, LEGACY_SCORE_FILE)
+        self.index = {"version": INDEX_VERSION, "log_size": 0, "entries": {}}
+        self.queue = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()  # Guards self.index between the game and the writer
+
+    def open(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+            if index.get("version") == INDEX_VERSION:
+                self.index = index
+        except (OSError, ValueError):
+            self.import_legacy()
+        # Catch up with runs logged after the index was last written
+        self.read_log(self.index["log_size"])
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def import_legacy(self):
+        # Old per-song high scores become difficulty 0 ("unknown") entries
+        try:
+            with open(self.legacy_path) as file:
+                legacy = json.load(file)
+        except (OSError, ValueError):
+            return
+        for song, score in legacy.items():
+            self.index["entries"][entry_key(song, LEGACY_DIFFICULTY)] = {"best": score, "runs": 0}
+
+    def read_log(self, offset):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # Half written last line from a crash; it is overwritten by the next run
+                try:
+                    run = dict(zip(RUN_FIELDS, json.loads(line)))
+                except ValueError:
+                    continue
+                self.add_to_index(run)
+                offset += len(line)
+        self.index["log_size"] = offset
+
+    def add_to_index(self, run):
+        entry = self.index["entries"].setdefault(entry_key(run["song"], run["difficulty"]), {"best": 0, "runs": 0})
+        entry["best"] = max(entry["best"], run["score"])
+        entry["runs"] += 1
+
+    def best(self, song, difficulty=None):
+        # Best score for a song at one difficulty, or at any difficulty.
+        # A difficulty without runs yet shows the song's legacy best, if it had one.
+        entries = self.index["entries"]
+        if difficulty is not None:
+            entry = entries.get(entry_key(song, difficulty)) or entries.get(entry_key(song, LEGACY_DIFFICULTY), {})
+            return entry.get("best", 0)
+        prefix = f"{song}:"
+        return max((entry["best"] for key, entry in entries.items() if key.startswith(prefix)), default=0)
+
+    def record(self, song, difficulty, score, max_combo, counts, completed=True):
+        # Called from the game thread: the index is updated now, the disk write happens on the writer thread
+        run = {
+            "time": int(time.time()),
+            "song": song,
+            "difficulty": difficulty,
+            "score": score,
+            "max_combo": max_combo,
+            "completed": int(completed),
+        }
+        run.update(counts)
+        with self.lock:
+            self.add_to_index(run)
+        self.queue.put(run)
+
+    def write_loop(self):
+        while True:
+            run = self.queue.get()
+            if run is None:
+                break
+            line = json.dumps([run[field] for field in RUN_FIELDS], separators=(",", ":")) + "\n"
+            with open(self.log_path, "ab") as file:
+                file.seek(self.index["log_size"])  # Drop a half written line left by a crash
+                file.truncate()
+                file.write(line.encode())
+                file.flush()
+                os.fsync(file.fileno())
+            with self.lock:
+                self.index["log_size"] += len(line.encode())
+                text = json.dumps(self.index)
+            write_atomic(self.index_path, text)
+
+    def history(self, song=None, difficulty=None):
+        # Streams the logged runs, oldest first, without loading the whole log
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path) as file:
+            for line in file:
+                try:
+                    run = dict(zip(RUN_FIELDS, json.loads(line)))
+                except ValueError:
+                    continue
+                if (song is None or run["song"] == song) and (difficulty is None or run["difficulty"] == difficulty):
+                    yield run
+
+    def close(self):
+        # Wait for pending writes
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
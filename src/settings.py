@@ -0,0 +1,38 @@
+import json
+
+from files import write_atomic
+
+# Player settings, read from settings.json next to the game. Keys missing from
+# the file keep their defaults, so an old or hand-written file still works.
+SETTINGS_FILE = "settings.json"
+DEFAULTS = {
+    "render_size": [1280, 720],  # Internal resolution the game is drawn at
+    "window_size": [1280, 720],  # Initial window size, the frame is scaled to fit it (not used with vsync pacing)
+    "smooth_scaling": False,  # Filter the frame when scaling it to the window (slower)
+    "audio_frequency": 44100,  # Mixer sample rate (Hz)
+    "audio_buffer": 512,  # Mixer buffer in samples; smaller is less latency, too small crackles
+    "audio_offset_ms": 0,  # How late the player hears the music, measured by the calibration
+    "song_folder": ".",  # Every .mp3, .ogg and .wav file in it is a song
+    "frame_pacing": "sleep",  # sleep, hybrid (sleep then spin), uncapped or vsync, see pacing.py
+    "frame_rate": 60,  # Target frames per second, 0 for none
+}
+
+
+def load_settings(path=SETTINGS_FILE):
+    settings = dict(DEFAULTS)
+    try:
+        with open(path) as file:
+            settings.update(json.load(file))
+    except (OSError, ValueError):
+        pass
+    return settings
+
+
+def save_settings(settings, path=SETTINGS_FILE):
+    write_atomic(path, json.dumps(settings, indent=2))
+
+
+def parse_size(text):
+    # "640x360" -> [640, 360], for command line options
+    width, height = text.lower().split("x")
+    return [int(width), int(height)]